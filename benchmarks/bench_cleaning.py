@@ -0,0 +1,96 @@
+import os
+import re
+import sys
+import time
+import argparse
+
+import pandas as pd
+
+from typing import Callable, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.utils import float_safe_cast
+from utils.data_utils import (clean_alcohol, clean_vintage, split_grapes,
+                              GRAPE_NOISE)
+
+"""Benchmark of the Alcohol, Vintage and Grapes cleaning of the dashboard.
+
+Runs the former per-row lambdas and the vectorized utils.data_utils
+functions on a country's CSV repeated 1x to `--scale`x, checks that both
+give the same columns and grape vocabulary, and reports rows/sec, which
+stays flat for the vectorized version as the data grows.
+
+use: python benchmarks/bench_cleaning.py [-c italy] [--scale 100]
+"""
+
+
+def legacy_clean(data: pd.DataFrame) -> Tuple[pd.DataFrame, set]:
+    """
+    The cleaning of load_data before utils.data_utils vectorized it.
+    """
+    data = data.copy()
+    data['Alcohol'] = data['Alcohol'].fillna(0).apply(
+        lambda x: float_safe_cast(0 if str(x).lower() in
+                                ['full', 'medium', 'light'] else x))
+    data['Alcohol'] = data['Alcohol'].apply(lambda x: float(x))
+    data['Vintage'] = data['Vintage'].fillna(0).apply(
+        lambda x: float_safe_cast(x))
+    data['Grapes'] = data['Grapes'].apply(
+        lambda x: str(x)[1:-1].replace("'", '').split(',')
+        if str(x)[1:-1].replace("'", '').split(',')[0] != 'a' else [])
+    grape_list = re.sub('[0-9%.]', '', str(', '.join(
+        data['Grapes'].fillna('').apply(
+        lambda x: ', '.join(x).replace(' ', '')
+        if x != ['a'] or x != 'a' else None).values))).replace(
+            ',,', ',').replace(' ', '').replace('"', '')
+    return data, set(grape_list.split(','))
+
+
+def grape_vocabulary(grapes: pd.Series) -> set:
+    """
+    The grape names of a Grapes column of lists, without shares
+    or spaces, e.g. 'CabernetSauvignon'. Includes '' when a wine
+    has no grapes, as the legacy vocabulary did.
+    """
+    tokens = grapes.explode()
+    names = set(pd.Series(tokens.dropna().unique()).astype(str).str.replace(
+        GRAPE_NOISE, '', regex=True))
+    if tokens.isna().any():
+        names.add('')
+    return names
+
+
+def vectorized_clean(data: pd.DataFrame) -> Tuple[pd.DataFrame, set]:
+    data = data.copy()
+    data['Alcohol'] = clean_alcohol(data['Alcohol'])
+    data['Vintage'] = clean_vintage(data['Vintage'])
+    data['Grapes'] = split_grapes(data['Grapes'])
+    return data, grape_vocabulary(data['Grapes'])
+
+
+def bench(clean: Callable, data: pd.DataFrame) -> float:
+    start = time.perf_counter()
+    clean(data)
+    return len(data) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--country', default='italy')
+    parser.add_argument('--scale', type=int, default=100)
+    args = parser.parse_args()
+
+    raw = pd.read_csv(f'wine_data_{args.country}.csv', sep=';', index_col=0)
+    old, new = legacy_clean(raw), vectorized_clean(raw)
+    pd.testing.assert_frame_equal(old[0], new[0])
+    assert old[1] == new[1], old[1] ^ new[1]
+
+    print(f'{args.country}: {len(raw)} rows, identical output')
+    print(f'{"scale":>6} {"rows":>9} {"legacy rows/s":>14} '
+          f'{"vectorized rows/s":>18} {"speedup":>8}')
+    scales = sorted({1, 10, args.scale})
+    for scale in scales:
+        data = pd.concat([raw] * scale, ignore_index=True)
+        before, after = bench(legacy_clean, data), bench(vectorized_clean, data)
+        print(f'{scale:>5}x {len(data):>9} {before:>14.0f} '
+              f'{after:>18.0f} {after / before:>7.1f}x')
@@ -0,0 +1,105 @@
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+import urllib.request
+
+from parsel import Selector
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.parse_utils import parse_wine_detail, grape_parsing
+
+"""Micro-benchmark of the detail page extraction of SpiderDecanter.parse_link.
+
+Parses saved detail pages with the former extractor (three XPath queries,
+regexes compiled on every call) and with utils.parse_utils.parse_wine_detail,
+checks that both return the same wine and reports items/sec on one core.
+
+use: python benchmarks/bench_parse.py [-n 2000] [fixtures ...]
+     python benchmarks/bench_parse.py --save <detail_url> [<detail_url> ...]
+"""
+
+FIXTURES: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'fixtures')
+
+
+def legacy_extract(link: Selector) -> Tuple[str, Dict[str, Any]]:
+    """
+    The extraction of parse_link before utils.parse_utils.
+    """
+    title = link.xpath(
+        '//h1[@class="WineInfo_wine-title__X8VR4"]/text()').get()
+    data_ = link.xpath(
+        '//div[contains(@class, "WineInfo_wineInfo__item__type")]/text()'
+        ).getall()
+    data__ = [re.search(r'<div>(.*)</div>', i).group(1)
+              for i in link.xpath(
+                  '//div[contains(@class, "WineInfo_wineInfo__item__value")]/div'
+                  ).getall()
+              if re.search(r'<div>(.*)</div>', i)]
+    temp = [i[0] if len(i) == 1 else grape_parsing(i)
+            if len(i) > 1 else ''
+            for i in
+            [re.findall(r'(\w*\s?\w+%?)\s*<', i) for i in data__]]
+    data__ = [temp[i] if temp[i] else j for i, j in enumerate(data__)]
+    return title, {i: j for i, j in zip(data_, data__)}
+
+
+def single_pass_extract(link: Selector) -> Tuple[str, Dict[str, Any]]:
+    return parse_wine_detail(link.root)
+
+
+def bench(extract: Callable, pages: List[str], rounds: int) -> float:
+    """
+    Items/sec of an extractor, HTML parsing included as in Scrapy.
+    """
+    start = time.process_time()
+    for _ in range(rounds):
+        for page in pages:
+            extract(Selector(text=page))
+    return rounds * len(pages) / (time.process_time() - start)
+
+
+def save(urls: List[str]) -> None:
+    for url in urls:
+        path = os.path.join(FIXTURES, url.rstrip('/').split('/')[-1] + '.html')
+        request = urllib.request.Request(
+            url, headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(request, timeout=30) as in_, \
+                open(path, 'wb') as out_:
+            out_.write(in_.read())
+        print('saved', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fixtures', nargs='*',
+                        default=sorted(glob.glob(os.path.join(FIXTURES,
+                                                              '*.html'))))
+    parser.add_argument('-n', '--rounds', type=int, default=2000)
+    parser.add_argument('--save', nargs='+', metavar='URL',
+                        help='download detail pages into benchmarks/fixtures')
+    args = parser.parse_args()
+    if args.save:
+        save(args.save)
+        sys.exit()
+
+    pages = []
+    for path in args.fixtures:
+        with open(path, encoding='utf-8') as file_:
+            pages.append(file_.read())
+    for page in pages:
+        old, new = (legacy_extract(Selector(text=page)),
+                    single_pass_extract(Selector(text=page)))
+        assert old[0] == new[0] and old[1].keys() == new[1].keys(), (old, new)
+        assert all(sorted(j) == sorted(new[1][i]) if isinstance(j, list)
+                   else j == new[1][i] for i, j in old[1].items()), (old, new)
+
+    before = bench(legacy_extract, pages, args.rounds)
+    after = bench(single_pass_extract, pages, args.rounds)
+    print(f'{len(pages)} fixture(s), {args.rounds} rounds')
+    print(f'legacy:      {before:10.0f} items/sec')
+    print(f'single pass: {after:10.0f} items/sec ({after / before:.2f}x)')
@@ -1,18 +1,43 @@
-import pandas as pd
-import json
 import os
+import sys
 
-"""Converts a JSON file scraped from Decanter's wine reviews page to a CSV file."""
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.output_utils import jsonl_to_csv, merge_jsonl_into_csv
+from utils.checkpoint_utils import CheckpointLedger
 
-country = '''argentina'''
+from envyaml import EnvYAML
 
-filename = f'scrapy/decanter_{country}.json'
+"""Converts the JSON lines feeds scraped from Decanter's wine reviews page to CSV files.
 
-with open(filename, 'r', encoding='utf-8') as json_:
-    json__ = json.loads(json_.read())
+The spider writes the CSV files itself; this is only needed for feeds kept
+with `-a formats=jsonl`, e.g. to rebuild a CSV from its feed.
 
-pd.DataFrame.from_records(json__).to_csv(
-    f'wine_data_{country}.csv', sep=';')
+use: python scrapy/json_parser.py <country|country,country|all> [incremental]
+"""
 
-if os.path.exists(filename):
-    os.remove(filename)
+CONF = EnvYAML(os.path.join('utils', 'config.yaml'))
+
+args = sys.argv[1:]
+incremental = 'incremental' in args
+country = next((i for i in args if i != 'incremental'), 'argentina')
+countries = ([i.lower() for i in CONF['COUNTRIES'] if i]
+             if country == 'all' else country.lower().split(','))
+
+ledger = CheckpointLedger('checkpoints.sqlite')
+for country in countries:
+    filename = f'scrapy/decanter_{country}.jsonl'
+
+    if not os.path.exists(filename):
+        print('no new items in', filename)
+    elif incremental:
+        # New reviews go in front of the rows already in the CSV
+        merge_jsonl_into_csv(filename, f'wine_data_{country}.csv', sep=';')
+    else:
+        jsonl_to_csv(filename, f'wine_data_{country}.csv', sep=';')
+
+    # The feed is kept while the crawl is unfinished so it can be resumed,
+    # unless it was merged, as merging it again would duplicate its rows
+    if os.path.exists(filename) and (incremental
+                                     or not ledger.in_progress(country)):
+        os.remove(filename)
+ledger.close()
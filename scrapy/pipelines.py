@@ -0,0 +1,140 @@
+import os
+import sys
+
+from typing import Dict, List, Any
+
+from scrapy import signals
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.output_utils import (JsonlWriter, CsvBatchWriter, ParquetBatchWriter,
+                                WINE_COLUMNS, merge_csv_into_csv,
+                                read_csv_rows, pa)
+from utils.record_utils import wine_parquet_writer, csv_to_wine_parquet
+
+"""Item pipelines of SpiderDecanter."""
+
+
+class CountryFeedPipeline:
+    """
+    Appends every item to the JSON lines feed of its country,
+    scrapy/decanter_<country>.jsonl, so a single crawl of several
+    countries still produces one feed per country.
+
+    Items carry their country in the `_country` key, which is not
+    written; the `_page` key is kept to order the rows later.
+    Only enabled with the spider's `formats=jsonl` argument.
+    """
+
+    def open_spider(self, spider) -> None:
+        self.writers: Dict[str, JsonlWriter] = {}
+
+    def process_item(self, item: Dict[str, Any], spider) -> Dict[str, Any]:
+        country = item['_country']
+        feed = spider.crawls[country].parts.get('jsonl')
+        if not feed:
+            return item
+        if country not in self.writers:
+            self.writers[country] = JsonlWriter(feed, 'a', sync=False)
+        self.writers[country].write(
+            [{i: j for i, j in item.items() if i != '_country'}])
+        return item
+
+    def close_spider(self, spider) -> None:
+        for writer in self.writers.values():
+            writer.close()
+
+
+class ColumnarFeedPipeline:
+    """
+    Writes every item straight to the CSV, and optionally Parquet,
+    part files of its country while the crawl runs, replacing the
+    JSON lines feed + json_parser.py round trip.
+
+    CSV rows are appended and flushed per item, so an interrupted
+    crawl can be resumed from the CSV part. Parquet rows are
+    buffered and written one row group per `PARQUET_BATCH` items,
+    as typed WineRecords; a resumed Parquet part is rebuilt from
+    the CSV part first.
+
+    Once the spider is closed, the parts of every finished country
+    become wine_data_<country>.csv / .parquet; in incremental mode
+    they are merged in front of the existing CSV instead.
+    """
+
+    PARQUET_BATCH: int = 500
+
+    @classmethod
+    def from_crawler(cls, crawler) -> 'ColumnarFeedPipeline':
+        pipeline = cls()
+        crawler.signals.connect(pipeline.spider_closed,
+                                signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider) -> None:
+        if pa is None and any('parquet' in i.parts
+                              for i in spider.crawls.values()):
+            raise ImportError('pyarrow is required for formats=parquet')
+        self.csv: Dict[str, CsvBatchWriter] = {}
+        self.parquet: Dict[str, ParquetBatchWriter] = {}
+        self.batches: Dict[str, List[Dict[str, Any]]] = {}
+        self.unknown: set = set()
+
+    def _open(self, country: str, spider) -> None:
+        parts = spider.crawls[country].parts
+        self.csv[country] = CsvBatchWriter(parts['csv'], WINE_COLUMNS)
+        if 'parquet' in parts:
+            seed = read_csv_rows(parts['csv'])[1] if self.csv[
+                country].rows else ()
+            self.parquet[country] = wine_parquet_writer(
+                parts['parquet'], seed, self.PARQUET_BATCH)
+            self.batches[country] = []
+
+    def process_item(self, item: Dict[str, Any], spider) -> Dict[str, Any]:
+        country = item['_country']
+        if country not in self.csv:
+            self._open(country, spider)
+        unknown = set(i for i in item if not i.startswith('_')) - set(
+            WINE_COLUMNS) - self.unknown
+        if unknown:
+            self.unknown |= unknown
+            spider.logger.warning('fields not written: %s', sorted(unknown))
+        self.csv[country].write([item])
+        if country in self.parquet:
+            self.batches[country].append(item)
+            if len(self.batches[country]) >= self.PARQUET_BATCH:
+                self.parquet[country].write(self.batches.pop(country))
+                self.batches[country] = []
+        return item
+
+    def close_spider(self, spider) -> None:
+        for country, writer in self.parquet.items():
+            writer.write(self.batches[country])
+            writer.close()
+        for writer in self.csv.values():
+            writer.close()
+
+    def spider_closed(self, spider, reason: str) -> None:
+        """
+        Moves the parts of the countries whose crawl finished to
+        their final files; unfinished parts are kept for a resume.
+        """
+        for country, crawl in spider.crawls.items():
+            parts = crawl.parts
+            final = f'wine_data_{country}'
+            if not os.path.exists(parts['csv']):
+                spider.logger.info('%s: no new items', country)
+            elif crawl.incremental:
+                # New reviews go in front of the rows already in the CSV,
+                # and the parts are dropped so they are never merged twice
+                merge_csv_into_csv(parts['csv'], f'{final}.csv')
+                if 'parquet' in parts:
+                    csv_to_wine_parquet(f'{final}.csv', f'{final}.parquet')
+            elif spider.crawl_finished(crawl, reason):
+                for fmt in ('csv', 'parquet'):
+                    if fmt in parts:
+                        os.replace(parts[fmt], f'{final}.{fmt}')
+            else:
+                continue
+            for part in (parts['csv'], parts.get('parquet')):
+                if part and os.path.exists(part):
+                    os.remove(part)
@@ -1,119 +1,310 @@
 import os
-import re
+import sys
 import scrapy
+import argparse
 
 from envyaml import EnvYAML
+from urllib.parse import urlsplit
 from scrapy.crawler import CrawlerProcess
 
-from typing import List, Dict, Any
+from typing import List, Dict, Union
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keeps pipelines.py importable once runspider has loaded this file
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from utils.checkpoint_utils import CheckpointLedger, url_path
+from utils.output_utils import read_csv_column
+from utils.parse_utils import parse_wine_detail
 
 CONF = EnvYAML(os.path.join('utils', 'config.yaml'))
 
-global page, url, country_, limit_
-url: str = 'https://www.decanter.com/wine-reviews/search/country/page/{page}/3'
-page: int = 0
-limit_: int = 0
-country_: str = ''
+COUNTRY: str = 'argentina'
+URL: str = '{base_url}/wine-reviews/search/{country}/page/{page}/3'
+# Files written while a country is crawled, per output format
+PARTS: Dict[str, str] = {'csv': 'scrapy/decanter_{country}.csv',
+                         'parquet': 'scrapy/decanter_{country}.parquet',
+                         'jsonl': 'scrapy/decanter_{country}.jsonl'}
+TRUE: tuple = ('1', 'true', 'yes')
 
 
-def grape_parsing(list_: List[str]) -> List[str]:
+class CountryCrawl:
+    """
+    Crawl state of one country inside SpiderDecanter: its listing
+    window, the pages and wines already finished and the ones in
+    flight.
     """
-    Function to parse grape information from the data scraped from website.
 
-    Args:
-        list_: list of grape information
+    def __init__(self, country: str, limit: int, ledger: CheckpointLedger,
+                 resume: bool = False, incremental: bool = False,
+                 formats: List[str] = ('csv', 'parquet'),
+                 base_url: str = CONF['BASE_URL']) -> None:
+        """
+        Args:
+            country: name of the country crawled
+            limit: limit of pages to scrape data from
+            ledger: checkpoint ledger shared by all countries
+            resume: continue the last interrupted crawl
+            incremental: only scrape the reviews newer than
+                wine_data_<country>.csv
+            formats: output formats, among csv, parquet and jsonl;
+                csv is always written as it is what a resumed
+                crawl continues from
+            base_url: site crawled
+        """
+        self.country = country
+        self.limit = limit or CONF[country]
+        self.url = URL.replace('{base_url}', base_url.rstrip('/')
+                               ).replace('{country}', country)
+        self.parts = {i: PARTS[i].format(country=country)
+                      for i in PARTS if i == 'csv' or i in formats}
+        resumed = ledger.start(country, resume)
+        # A Parquet part is rebuilt from the CSV part, the others are needed
+        if resumed and not all(os.path.exists(j) for i, j in
+                               self.parts.items() if i != 'parquet'):
+            resumed = ledger.start(country)
+        if not resumed:
+            for i in self.parts.values():
+                if os.path.exists(i):
+                    os.remove(i)
+        self.done_pages = ledger.finished_pages(country)
+        self.done_urls = ledger.finished_urls(country)
+        self.incremental = incremental
+        self.known_titles = read_csv_column(
+            f'wine_data_{country}.csv', 'Title') if incremental else set()
+        if incremental:
+            # Only the URLs of finished crawls, whose items were merged,
+            # the parts of an unfinished one having been removed above
+            self.done_urls |= ledger.known_urls(country)
+        self.scheduled = 0
+        self.stop = False
+        self.new: Dict[int, int] = {}
+        self.pending: Dict[int, set] = {}
+        self.requested: set = set()
+        self.failed: set = set()
 
-    Returns:
-        list: parsed grape information
-    """
-    out = []
-    for i in range(0, len(list_), 2):
-        if list_[i][0].isnumeric():
-            out.append(list_[i].strip() + ' ' + list_[i+1].strip())
-        else:
-            try:
-                out.append(list_[i].strip())
-                out.append(list_[i+1].strip())
-            except:
-                out.append(list_[i].strip())
-    return list(set(out))
+    def next_page(self, page: int) -> int:
+        """
+        First page after `page` not finished by the current crawl,
+        or 0 when there is none left.
+        """
+        page += 1
+        while page in self.done_pages:
+            page += 1
+        return page if page <= self.limit else 0
 
 
 class SpiderDecanter(scrapy.Spider):
-    global page, country_, limit_, url
-    
-    def __init__(self, country=None, limit=0, *args, **kwargs):
+    """
+    Spider crawling the Decanter reviews of one or more countries
+    in a single run, sharing one request queue.
+
+    Listing pages are requested in a sliding window per country:
+    `window` of them are in flight at once and each parsed listing
+    requests the next one, so discovery scales with
+    CONCURRENT_REQUESTS instead of waiting for one page at a time.
+    Items are written to the final files of their country while
+    the crawl runs by ColumnarFeedPipeline, and optionally to a
+    JSON lines feed by CountryFeedPipeline.
+    """
+
+    name = 'decanter'
+
+    allowed_domains = ['www.decanter.com']
+    custom_settings = {
+        'ITEM_PIPELINES': {'pipelines.ColumnarFeedPipeline': 300,
+                           'pipelines.CountryFeedPipeline': 400},
+        }
+
+    def __init__(self, country=None, limit=0, resume=False,
+                 incremental=False, window=0, formats='csv,parquet',
+                 base_url=None, *args, **kwargs):
         """
         Constructor to initialize the spider.
 
         Args:
-            country: name of the country to scrape data for
-            limit: limit of pages to scrape data from
+            country: name of the country to scrape data for, a
+                comma-separated list of countries, or "all" for
+                every country of CONF['COUNTRIES']
+            limit: limit of pages to scrape data from, per country
+                (default: the country's value in the config)
+            resume: continue the last interrupted crawl of the
+                countries, skipping the pages and wines it finished
+            incremental: only scrape the reviews newer than
+                wine_data_<country>.csv, stopping once a page
+                has no new wine
+            window: number of listing pages in flight at once per
+                country (default: CONCURRENT_REQUESTS, 2 when
+                incremental)
+            formats: comma-separated output formats (default:
+                csv,parquet): csv writes wine_data_<country>.csv
+                (always on), parquet writes the typed
+                wine_data_<country>.parquet and jsonl keeps the
+                scrapy/decanter_<country>.jsonl feed for
+                json_parser.py
+            base_url: site crawled (default: CONF['BASE_URL']),
+                e.g. a replay server of recorded pages
         """
-        global country_, limit_
         super(SpiderDecanter, self).__init__(*args, **kwargs)
-        if not country:
-            country = '''argentina'''
-        if country.capitalize() in CONF['COUNTRIES'] and not country.isnumeric():
-            country_ = str(country.lower())
-            self.country_ = country_
-        else:
-            print('country', country, 'not in', CONF['COUNTRIES'])
-        if type(limit) == int or limit.isnumeric():
-            limit_ = int(limit)
-            self.limit_ = limit_
-        else:
+        countries = parse_countries(country or COUNTRY)
+        if type(limit) != int and not limit.isnumeric():
             print('limit', limit, 'is not numeric')
-    
-    name = 'decanter'
-    country_ = '''argentina''' if not country_ else country_
-    limit_ = CONF[country_] if not limit_ else limit_
-    url = url.replace('country', country_)
+            limit = 0
+        self.window = int(window)
+        self.incremental = str(incremental).lower() in TRUE
+        base_url = base_url or CONF['BASE_URL']
+        self.allowed_domains = [urlsplit(base_url).hostname]
+        self.ledger = CheckpointLedger('checkpoints.sqlite')
+        self.crawls: Dict[str, CountryCrawl] = {
+            i: CountryCrawl(i, int(limit), self.ledger,
+                            str(resume).lower() in TRUE, self.incremental,
+                            formats.lower().split(','), base_url)
+            for i in countries}
 
-    start_urls = [url.format(page=page+1)]
-    allowed_domains = ['www.decanter.com']
-    custom_settings = {
-        'FEED_FORMAT': 'json',
-        'FEED_URI': f'scrapy/decanter_{country_}.json',
-        'FEED_EXPORT_ENCODING': 'utf-8',
-        }
+    def next_listing(self, crawl: CountryCrawl) -> Union[scrapy.Request, None]:
+        """
+        Request for the next listing page of a country not scheduled
+        yet, or None once the limit or, in incremental mode, the
+        known reviews are reached.
+        """
+        page = 0 if crawl.stop else crawl.next_page(crawl.scheduled)
+        if not page:
+            return None
+        crawl.scheduled = page
+        return scrapy.Request(crawl.url.format(page=page),
+                              callback=self.parse,
+                              errback=self.listing_failed,
+                              cb_kwargs={'country': crawl.country,
+                                         'page': page})
 
-    def parse(self, response):
-        global page, url, limit_, country_
+    def start_requests(self):
+        # Incremental runs stop early, a short window bounds the overshoot
+        window = self.window or (2 if self.incremental else
+                                 self.settings.getint('CONCURRENT_REQUESTS'))
+        for _ in range(window):
+            for crawl in self.crawls.values():
+                request = self.next_listing(crawl)
+                if request is not None:
+                    yield request
 
+    def parse(self, response, country, page):
+        crawl = self.crawls[country]
         link = response.xpath(
-            f'//a[contains(@href, "/wine-reviews/{country_}/")]/@href').getall()
+            f'//a[contains(@href, "/wine-reviews/{country}/")]/@href'
+            ).getall()
+        link = [i for i in dict.fromkeys(response.urljoin(i) for i in link)
+                if url_path(i) not in crawl.done_urls
+                and i not in crawl.requested]
+        crawl.requested.update(link)
+        crawl.pending[page] = set(link)
+        if not link:
+            self.page_done(crawl, page)
+        # Deduplicated above: a request dropped by the dupe or offsite
+        # filters gets no callback and would keep its page pending
         for i in link:
+            yield response.follow(i, callback=self.parse_link,
+                                  errback=self.link_failed,
+                                  dont_filter=True,
+                                  cb_kwargs={'country': country,
+                                             'page': page, 'url': i})
 
-            yield response.follow(i, callback=self.parse_link)
-        page += 1
+        request = self.next_listing(crawl)
+        if request is not None:
+            yield request
 
-        if page < limit_:
-            yield response.follow(url.format(page=page+1),
-                                  callback=self.parse)
+    def listing_failed(self, failure):
+        crawl = self.crawls[failure.request.cb_kwargs['country']]
+        crawl.failed.add(failure.request.cb_kwargs['page'])
+        request = self.next_listing(crawl)
+        if request is not None:
+            yield request
 
-    def parse_link(self, link):
-        title = link.xpath(
-            '//h1[@class="WineInfo_wine-title__X8VR4"]/text()').get()
-        data_ = link.xpath(
-            '//div[contains(@class, "WineInfo_wineInfo__item__type")]/text()'
-            ).getall()
-        data__ = [re.search(r'<div>(.*)</div>', i).group(1)
-                  for i in link.xpath(
-                      '//div[contains(@class, "WineInfo_wineInfo__item__value")]/div'
-                      ).getall()
-                  if re.search(r'<div>(.*)</div>', i)]
-        temp = [i[0] if len(i) == 1 else grape_parsing(i)
-                if len(i) > 1 else ''
-                for i in
-                [re.findall(r'(\w*\s?\w+%?)\s*<', i) for i in data__]]
-        data__ = [temp[i] if temp[i] else j for i, j in enumerate(data__)]
-        ans = {i: j for i, j in zip(data_, data__)}
+    def page_done(self, crawl: CountryCrawl, page: int) -> None:
+        """
+        Records a listing page once all its wines are scraped. In
+        incremental mode, a page without new wines stops the
+        scheduling of further listing pages of the country.
+        """
+        if crawl.pending.get(page):
+            return
+        crawl.pending.pop(page, None)
+        if page not in crawl.failed:
+            self.ledger.mark_page(crawl.country, page, crawl.new.get(page, 0))
+        if crawl.incremental and not crawl.new.get(page) and not crawl.stop:
+            crawl.stop = True
+            self.logger.info('%s: known reviews reached at page %s',
+                             crawl.country, page)
+
+    def link_failed(self, failure):
+        crawl = self.crawls[failure.request.cb_kwargs['country']]
+        page = failure.request.cb_kwargs['page']
+        crawl.failed.add(page)
+        crawl.pending[page].discard(failure.request.cb_kwargs['url'])
+        self.page_done(crawl, page)
+
+    def crawl_finished(self, crawl: CountryCrawl, reason: str) -> bool:
+        """
+        Whether every page of a country was scraped by this run.
+        """
+        return reason == 'finished' and not crawl.failed and not any(
+            crawl.pending.values())
+
+    def closed(self, reason):
+        for crawl in self.crawls.values():
+            if self.crawl_finished(crawl, reason):
+                self.ledger.finish(crawl.country)
+        self.ledger.close()
+
+    def parse_link(self, link, country, page, url):
+        title, ans = parse_wine_detail(link.selector.root)
 
-        yield {'Title': title} | ans
+        crawl = self.crawls[country]
+        if title not in crawl.known_titles:
+            crawl.new[page] = crawl.new.get(page, 0) + 1
+            yield {'Title': title} | ans | {'_country': country,
+                                            '_page': page}
+        self.ledger.mark_urls(country, [url])
+        crawl.pending[page].discard(url)
+        self.page_done(crawl, page)
+
+
+def parse_countries(country: str) -> List[str]:
+    """
+    Function to parse the country argument of the spider.
+
+    Args:
+        country: a country, a comma-separated list of countries,
+            or "all" for every country of CONF['COUNTRIES']
+
+    Returns:
+        list: lowercase names of the known countries requested
+    """
+    if country.lower() == 'all':
+        return [i.lower() for i in CONF['COUNTRIES'] if i]
+    countries = []
+    for i in country.split(','):
+        i = i.strip()
+        if i.capitalize() in CONF['COUNTRIES'] and i and not i.isnumeric():
+            countries.append(i.lower())
+        else:
+            print('country', i, 'not in', CONF['COUNTRIES'])
+    return countries
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--country', default=COUNTRY,
+                        help='country, comma-separated countries or "all"')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='resume the last interrupted crawl')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only scrape the reviews newer than the CSV')
+    parser.add_argument('-f', '--formats', default='csv,parquet',
+                        help='comma-separated outputs: csv, parquet, jsonl')
+    parser.add_argument('-b', '--base-url', default=None,
+                        help='site crawled (default: BASE_URL of the config)')
+    args = parser.parse_args()
     proc = CrawlerProcess()
-    proc.crawl(SpiderDecanter)
+    proc.crawl(SpiderDecanter, country=args.country,
+               resume=args.resume, incremental=args.incremental,
+               formats=args.formats, base_url=args.base_url)
     proc.start()
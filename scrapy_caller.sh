@@ -1,17 +1,29 @@
 #!/bin/bash
 
-ARG=$1
+# use: scrapy_caller.sh <country|country,country|all> [resume|incremental|-] [csv,parquet,jsonl]
 
-if grep -q "$ARG:" utils/config.yaml; then
+ARG=$1
+EXTRA="-a formats=${3:-csv,parquet}"
+if [ "$2" == "resume" ]; then
+  EXTRA="$EXTRA -a resume=1"
+elif [ "$2" == "incremental" ]; then
+  EXTRA="$EXTRA -a incremental=1"
+fi
 
-  VALUE=$(grep "$ARG:" utils/config.yaml | cut -d':' -f2)
-  VALUE=$(echo "$VALUE" | sed 's/^[[:space:]]*//;s/[[:space:]]*$//')
+VALID=1
+if [ "$ARG" != "all" ]; then
+  for COUNTRY in ${ARG//,/ }; do
+    if ! grep -q "^$COUNTRY:" utils/config.yaml; then
+      VALID=0
+    fi
+  done
+fi
 
-  sed -zi "s/\('''\)[^']*\('''\)/\1$1\2/g" scrapy/spider_decanter.py
-  scrapy runspider scrapy/spider_decanter.py -a limit=$VALUE
+if [ "$VALID" == "1" ]; then
 
-  sed -zi "s/\('''\)[^']*\('''\)/\1$1\2/g" scrapy/json_parser.py
-  python scrapy/json_parser.py
+  # Every country runs in the same crawl, each with the page limit of the config;
+  # the item pipeline writes wine_data_<country>.csv (and .parquet) directly
+  scrapy runspider scrapy/spider_decanter.py -a country=$ARG $EXTRA
 
 else
 
@@ -1,25 +1,213 @@
 import os
 import argparse
-import pandas as pd
+import contextlib
 
 # from google.cloud import storage    # Uncomment to save/load the csv file in/from GCS
 
-from typing import List, Dict
+from typing import List, Dict, Union, Set, Tuple
 from concurrent.futures import ThreadPoolExecutor
 
 from envyaml import EnvYAML
 
-from utils.utils import timed_retries
-from utils.selenium_utils import (getDriver, find_element_data,
+from utils.utils import RetryScheduler, get_logger
+from utils.output_utils import (JsonlWriter, jsonl_to_csv,
+                                read_csv_column, merge_jsonl_into_csv)
+from utils.checkpoint_utils import CheckpointLedger, url_path
+from utils.record_utils import csv_to_wine_parquet
+from utils.http_utils import AsyncFetcher
+from utils.parse_utils import class_texts, page_links
+from utils.selenium_utils import (DriverPool, find_element_data_batched,
                                   click_element, page_interaction,
-                                  type_or_get_text)
+                                  type_or_get_text, get_links)
+from selenium.webdriver.remote.webdriver import WebDriver
 
 FILE_PREF: str = '' if 'wine_scraping' in os.getcwd() else '/tmp/'
 CONF = EnvYAML(os.path.join('utils', 'config.yaml'))
 
 
-@timed_retries(max_retries=6, minutes=2)
-def get_wine_info(page: int, country: str, headless: bool,
+IMG_SRC: str = 'https://decanter-prod-aws1-timeincuk-net.s3.eu-west-1'
+TITLE_CLASS: str = 'WineInfo_wine-title__X8VR4'
+INFO_CLASS: str = 'column is-4 WineInfo_wineInfo__OVnX8'
+
+
+def parse_wine_info(title: str, info: str
+                    ) -> Dict[str, Union[str, List[str]]]:
+    """
+    Maps the text of a wine detail page to a record.
+
+    Args:
+        title (str): Text of the wine title element
+        info (str): Text of the WineInfo block, alternating
+            field names and values one per line, with the
+            grapes listed last
+
+    Returns:
+        Dict[str, Union[str, List[str]]]: Wine record with
+        the Grapes field as a list.
+    """
+    data_, info__ = {'Title': title}, info.split('\n')
+    for i in range(0, len(info__), 2):
+        if info__[i] == 'Grapes':
+            data_[info__[i]] = info__[i+1:]
+            break
+        else:
+            data_[info__[i]] = info__[i+1] if i+1 < len(info__) else ''
+    return data_
+
+
+def read_wine_page(driver: WebDriver, url: str = None
+                   ) -> Dict[str, Union[str, List[str]]]:
+    """
+    Reads the title and WineInfo block of the detail page
+    loaded in the driver, refreshing once if it is not ready.
+
+    Args:
+        driver (WebDriver): Driver showing a wine detail page
+        url (str): URL the page was opened with, defaults to
+            the current URL of the driver
+
+    Returns:
+        Dict[str, Union[str, List[str]]]: Wine record, with the
+        page URL under the `_url` metadata key.
+    """
+    def read() -> Dict[str, Union[str, List[str]]]:
+        title_ = type_or_get_text(
+            driver, 5, find_element_data_batched(
+                driver, contains_class=TITLE_CLASS,
+                return_xpath=True), action='get')
+        info_ = type_or_get_text(
+            driver, 5, find_element_data_batched(
+                driver, contains_class=INFO_CLASS,
+                return_xpath=True), action='get')
+        return parse_wine_info(title_, info_) | {
+            '_url': url or driver.current_url}
+    try:
+        return read()
+    except Exception:
+        page_interaction(driver, 'refresh')
+        return read()
+
+
+def read_wine_html(html: str, url: str
+                   ) -> Dict[str, Union[str, List[str]]]:
+    """
+    Reads the title and WineInfo block of a detail page from its
+    server HTML, without a browser.
+
+    Args:
+        html (str): HTML of a wine detail page
+        url (str): URL of the page
+
+    Returns:
+        Dict[str, Union[str, List[str]]]: Wine record, with the
+        page URL under the `_url` metadata key.
+
+    Raises:
+        ValueError: If the page has no title or WineInfo block.
+    """
+    title_, info_ = class_texts(html, TITLE_CLASS, INFO_CLASS)
+    if not title_ or not info_:
+        raise ValueError(f'no wine info in {url}')
+    return parse_wine_info(title_, info_) | {'_url': url}
+
+
+def fetch_detail_links(fetcher: AsyncFetcher, links: List[str]
+                       ) -> Tuple[List[Dict[str, Union[str, List[str]]]],
+                                  List[str]]:
+    """
+    Fetches wine detail pages concurrently over HTTP and parses
+    them without a browser.
+
+    Args:
+        fetcher (AsyncFetcher): Pooled HTTP client
+        links (List[str]): Detail page URLs
+
+    Returns:
+        Tuple: Wine records, and the URLs of the pages that could
+        not be parsed.
+
+    Raises:
+        Exception: The first fetch error, so the page is retried.
+    """
+    full_, unparsed = [], []
+    for link, html in zip(links, fetcher.get_many(links)):
+        if isinstance(html, Exception):
+            raise html
+        try:
+            full_.append(read_wine_html(html, link))
+        except ValueError:
+            unparsed.append(link)
+    return full_, unparsed
+
+
+def visit_detail_links(driver: WebDriver, links: List[str],
+                       tabs: int = 4) -> List[Dict[str, Union[str, List[str]]]]:
+    """
+    Visits wine detail pages by URL, loading up to `tabs` of
+    them at a time in parallel browser tabs.
+
+    Args:
+        driver (WebDriver): Driver showing the listing page
+        links (List[str]): Detail page URLs
+        tabs (int): Number of tabs loading at once
+
+    Returns:
+        List[Dict[str, Union[str, List[str]]]]: Wine records
+        in the order of `links`.
+    """
+    full_, main_ = [], driver.current_window_handle
+    for start in range(0, len(links), tabs):
+        opened = []
+        for link in links[start:start+tabs]:
+            known = set(driver.window_handles)
+            driver.execute_script(
+                'window.open(arguments[0], "_blank");', link)
+            opened += [(i, link) for i in driver.window_handles
+                       if i not in known]
+        for handle, link in opened:
+            driver.switch_to.window(handle)
+            full_.append(read_wine_page(driver, link))
+            driver.close()
+        driver.switch_to.window(main_)
+    return full_
+
+
+def click_detail_images(driver: WebDriver
+                        ) -> List[Dict[str, Union[str, List[str]]]]:
+    """
+    Visits wine detail pages by clicking each review image of
+    the listing page and navigating back. Used when the listing
+    exposes no detail links.
+
+    Args:
+        driver (WebDriver): Driver showing the listing page
+
+    Returns:
+        List[Dict[str, Union[str, List[str]]]]: Wine records.
+    """
+    full_ = []
+    for i in find_element_data_batched(driver, contains_src=IMG_SRC,
+                                       tag_name='img', time=5):
+        try:
+            click_element(
+                driver, 5, find_element_data_batched(
+                    driver, return_xpath=True,
+                    contains_src=i['src'], tag_name='img', time=5))
+        except Exception:
+            page_interaction(driver, 'refresh')
+            click_element(
+                driver, 5, find_element_data_batched(
+                    driver, return_xpath=True,
+                    contains_src=i['src'], tag_name='img', time=5))
+        full_.append(read_wine_page(driver))
+        page_interaction(driver, 'back')
+    return full_
+
+
+def get_wine_info(page: int, country: str, pool: DriverPool,
+                  direct: bool = True, skip_urls: Set[str] = frozenset(),
+                  base_url: str = CONF['BASE_URL'],
+                  fetcher: AsyncFetcher = None
                   ) -> List[Dict[str, str]]:
     """
     Scrapes wine information from Decanter website for a
@@ -28,112 +216,154 @@ def get_wine_info(page: int, country: str, headless: bool,
     Args:
         page (int): Page number of the website to scrape
         country (str): Country name to scrape wine information
-        headless (bool): Shows the Chrome drivers
+        pool (DriverPool): Pool the Chrome driver is leased from
+        direct (bool): Visit the detail pages by URL instead of
+            clicking through the listing
+        skip_urls (Set[str]): Paths of the detail URLs already scraped
+        base_url (str): Site scraped, e.g. a replay server of
+            recorded pages
+        fetcher (AsyncFetcher): Read the pages over HTTP instead,
+            leasing a driver only for the pages that fail to parse
 
     Returns:
         List[Dict[str, str]]: List of dictionaries with wine
         information scraped from website.
     """
-    try:
-        driver, full_ = getDriver('headless'
-                                  if not headless else None), []
-        driver.get(
-            f'''https://www.decanter.com\
-/wine-reviews/search/{country}/page/{page}/3''')
-
-        for i in find_element_data(
-                driver, contains_src=
-                'https://decanter-prod-aws1-timeincuk-net.s3.eu-west-1',
-                tag_name='img', time=5):
-            data_ = {}
-            try:
-                click_element(
-                    driver, 5, find_element_data(
-                        driver, return_xpath=True,
-                        contains_src=i['src'], tag_name='img', time=5))
-            except Exception:
-                page_interaction(driver, 'refresh')
-                click_element(
-                    driver, 5, find_element_data(
-                        driver, return_xpath=True,
-                        contains_src=i['src'], tag_name='img', time=5))
-            try:
-                title_ = type_or_get_text(
-                    driver, 5, find_element_data(
-                        driver, contains_class=
-                        'WineInfo_wine-title__X8VR4',
-                        return_xpath=True), action='get')
-                data_['Title'] = title_
-            except Exception:
-                page_interaction(driver, 'refresh')
-                title_ = type_or_get_text(
-                    driver, 5, find_element_data(
-                        driver, contains_class=
-                        'WineInfo_wine-title__X8VR4',
-                        return_xpath=True), action='get')
-                data_['Title'] = title_
-            try:
-                info_ = type_or_get_text(
-                    driver, 5, find_element_data(
-                        driver, contains_class=
-                        'column is-4 WineInfo_wineInfo__OVnX8',
-                        return_xpath=True), action='get')
-                info__ = info_.split('\n')
-                for i in range(0, len(info__), 2):
-                    if info__[i] == 'Grapes':
-                        data_[info__[i]] = info__[i+1:]
-                        break
-                    else:
-                        data_[info__[i]] = info__[i+1]
-            except Exception:
-                page_interaction(driver, 'refresh')
-                info_ = type_or_get_text(
-                    driver, 5, find_element_data(
-                        driver, contains_class=
-                        'column is-4 WineInfo_wineInfo__OVnX8',
-                        return_xpath=True), action='get')
-                info__ = info_.split('\n')
-                
-                for i in range(0, len(info__), 2):
-                    if info__[i] == 'Grapes':
-                        data_[info__[i]] = info__[i+1:]
-                        break
-                    else:
-                        data_[info__[i]] = info__[i+1]
-            full_.append(data_)
-            page_interaction(driver, 'back')
-        driver.quit()
-        return full_
-    finally:
-        driver.quit()
+    listing = f'''{base_url.rstrip('/')}\
+/wine-reviews/search/{country}/page/{page}/3'''
+    if fetcher is not None:
+        links = page_links(fetcher.get(listing), listing,
+                           f'/wine-reviews/{country}/')
+        if links:
+            full_, unparsed = fetch_detail_links(
+                fetcher, [i for i in links if url_path(i) not in skip_urls])
+            if unparsed:
+                with pool.lease(page) as driver:
+                    full_ += visit_detail_links(driver, unparsed)
+            return full_
+    with pool.lease(page) as driver:
+        driver.get(listing)
+        links = get_links(
+            driver, f'/wine-reviews/{country}/') if direct else []
+        if links:
+            return visit_detail_links(
+                driver, [i for i in links if url_path(i) not in skip_urls])
+        return [i for i in click_detail_images(driver)
+                if url_path(i['_url']) not in skip_urls]
 
 
 def main(country: str = 'france', headless: bool = False,
-         pages: int = 400) -> None:
+         pages: int = 400, direct: bool = True,
+         driver_path: str = None, resume: bool = False,
+         incremental: bool = False, base_url: str = None,
+         engine: str = 'selenium') -> None:
     """
     Scrapes wine data for a given country using multiple threads
     and saves the results to a CSV file.
 
+    The records of every page are appended to
+    wine_data_<country>.jsonl as soon as the page completes, and
+    the CSV is assembled from that stream at the end, so a crash
+    keeps the finished pages and memory does not grow with the
+    number of pages. The CSV is then stored as typed WineRecords
+    in wine_data_<country>.parquet.
+
+    Finished pages and detail URLs are recorded in a checkpoint
+    ledger; with `resume` an interrupted crawl keeps its stream
+    and skips the work it already finished.
+
+    With `incremental` the pages are scraped in order, one window
+    of workers at a time, skipping the wines already in the CSV or
+    the ledger. Paging stops after the first page with no new wine
+    and the new rows are merged in front of the existing CSV.
+
     Args:
         country: A string representing the name of the country to
             scrape wine data from (default: 'france').
         headless: Shows the chrome drivers.
         pages: The number of pages to scrape.
+        direct: Visit the detail pages by URL instead of
+            clicking through the listing.
+        driver_path: Pre-downloaded chromedriver binary.
+        resume: Continue the last interrupted crawl of the country.
+        incremental: Only scrape the reviews newer than the CSV.
+        base_url: Site scraped (default: CONF['BASE_URL']).
+        engine: 'selenium' renders every page in Chrome, 'http'
+            fetches the server HTML with a pooled async client and
+            only starts Chrome for the pages it cannot parse.
     """
-    with ThreadPoolExecutor(max_workers=6) as executor:
-        futures = [executor.submit(get_wine_info, page+1, country,
-                                   headless)
-                   for page in range(pages)]
-    ans = [x for future in futures if future.result()
-           for x in future.result()]
-    df = pd.DataFrame.from_records(ans)
-    df.to_csv(
-        f'{FILE_PREF}wine_data_{country}.csv', sep=';')
+    stream_ = f'{FILE_PREF}wine_data_{country}.jsonl'
+    csv_ = f'{FILE_PREF}wine_data_{country}.csv'
+    logger = get_logger('selenium_scraper',
+                        f'{FILE_PREF}scraper_log_{country}.jsonl')
+    ledger = CheckpointLedger(f'{FILE_PREF}checkpoints.sqlite')
+    resumed = ledger.start(country, resume)
+    if resumed and not os.path.exists(stream_):
+        # The finished pages of the crawl were lost with its stream
+        resumed = ledger.start(country)
+    done_pages = ledger.finished_pages(country)
+    # The URLs of an interrupted crawl are only skipped when it is
+    # resumed, with the stream that holds their records
+    skip_urls = ledger.finished_urls(country)
+    if incremental:
+        known_titles = read_csv_column(csv_, 'Title')
+        skip_urls |= ledger.known_urls(country)
+    else:
+        known_titles = set()
+    skip_urls = frozenset(skip_urls)
+    logger.info('crawl started', extra={'fields': {
+        'country': country, 'resumed': resumed,
+        'incremental': incremental,
+        'finished_pages': len(done_pages)}})
+    with JsonlWriter(stream_, 'a' if resumed else 'w') as sink, \
+            DriverPool(6, *([] if headless else ['headless']),
+                       driver_path=driver_path) as pool, \
+            (AsyncFetcher(concurrency=16) if engine == 'http'
+             else contextlib.nullcontext()) as fetcher, \
+            ThreadPoolExecutor(max_workers=pool.size) as executor:
+        scheduler = RetryScheduler(executor, get_wine_info,
+                                   max_retries=6, logger=logger)
+        window, stop = pool.size if incremental else pages, 0
+        for start in range(1, pages+1, window):
+            for page in range(start, min(start+window, pages+1)):
+                if page not in done_pages:
+                    scheduler.submit(page, page, country, pool,
+                                     direct, skip_urls,
+                                     base_url or CONF['BASE_URL'],
+                                     fetcher)
+            for page, records in scheduler.as_completed():
+                new_ = [i for i in records
+                        if i.get('Title') not in known_titles]
+                sink.write({'_page': page} | i for i in new_)
+                ledger.mark_urls(country, [i['_url'] for i in records])
+                ledger.mark_page(country, page, len(new_))
+                if incremental and not new_:
+                    stop = min(stop or page, page)
+            if stop:
+                logger.info('known reviews reached', extra={'fields': {
+                    'country': country, 'page': stop}})
+                break
+        logger.info('driver pool stats',
+                    extra={'fields': pool.summary()})
+    if incremental:
+        rows = merge_jsonl_into_csv(stream_, csv_)
+    else:
+        rows = jsonl_to_csv(stream_, csv_)
+    csv_to_wine_parquet(csv_, f'{FILE_PREF}wine_data_{country}.parquet')
+    logger.info('csv written', extra={'fields': {
+        'country': country, 'rows': rows,
+        'failed_pages': sorted(scheduler.failed)}})
+    if not scheduler.failed:
+        ledger.finish(country)
+    if incremental or not scheduler.failed:
+        # Merged rows are in the CSV, keeping them would merge them twice
+        os.remove(stream_)
+    ledger.close()
 
     # client = storage.Client()    # Uncomment to save/load the csv file in/from GCS
     # bucket = client.bucket('my-bucket-name')
     # blob = bucket.blob(f'wine_data_{country}.csv')
-    # blob.upload_from_string(df.to_csv(index=False), content_type='text/csv')
+    # blob.upload_from_filename(f'{FILE_PREF}wine_data_{country}.csv', content_type='text/csv')
 
 
 if __name__ == '__main__':
@@ -146,6 +376,28 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--pages', default=None,
                         type=int,
                         help='number of pages to scrape')
+    parser.add_argument('--click', default=None,
+                        action="store_true",
+                        help='click through the listing instead of '
+                             'visiting the detail links')
+    parser.add_argument('-r', '--resume', default=None,
+                        action="store_true",
+                        help='resume the last interrupted crawl')
+    parser.add_argument('-i', '--incremental', default=None,
+                        action="store_true",
+                        help='only scrape the reviews newer than '
+                             'wine_data_<country>.csv and merge them')
+    parser.add_argument('-d', '--driver', default=None,
+                        help='pre-downloaded chromedriver binary '
+                             '(default: $CHROMEDRIVER_PATH or '
+                             'webdriver-manager)')
+    parser.add_argument('-b', '--base-url', default=None,
+                        help='site scraped, e.g. a replay server '
+                             '(default: BASE_URL of the config)')
+    parser.add_argument('-e', '--engine', default='selenium',
+                        choices=['selenium', 'http'],
+                        help='http reads the server HTML without Chrome, '
+                             'falling back to Selenium per page')
     args = parser.parse_args()
     country = args.country.lower() if args.country else 'france'
     headless = args.show if args.show else False
@@ -153,5 +405,9 @@ if __name__ == '__main__':
         print(f'Country {country} not recognized')
     else:
         pages = args.pages if args.pages else CONF[country]
-        main(country=country, headless=headless, pages=pages)
+        main(country=country, headless=headless, pages=pages,
+             direct=not args.click, driver_path=args.driver,
+             resume=bool(args.resume),
+             incremental=bool(args.incremental),
+             base_url=args.base_url, engine=args.engine)
 
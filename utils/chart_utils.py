@@ -0,0 +1,206 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from utils.utils import LRUCache
+from utils.output_utils import WINE_COLUMNS
+from utils.filter_utils import FilterSpec
+
+# Group keys, aggregated columns and aggregation of each dashboard
+# chart; 'size' counts the rows of each group as Count
+CHARTS: Dict[str, Tuple[List[str], List[str], str]] = {
+    'alcohol_sweetness': (['Sweetness'], ['Alcohol', 'Vintage'], 'mean'),
+    'closure': (['Closure'], ['Title'], 'count'),
+    'colour_region': (['Colour', 'Region'], [], 'size'),
+    'body': (['Body', 'Oak'], ['Title'], 'count'),
+    'oak_alcohol': (['Oak', 'Grape_Categories', 'Region'],
+                    ['Alcohol', 'Vintage'], 'mean'),
+}
+# Columns of the data table, the Grapes lists are shown as
+# Grape_Categories
+TABLE_COLUMNS: List[str] = [i for i in WINE_COLUMNS if i != 'Grapes'] + [
+    'Grape_Categories']
+PAGE_SIZE: int = 50
+
+
+def aggregate(data: pd.DataFrame, chart: str) -> pd.DataFrame:
+    """
+    A function that computes the data of a dashboard chart from
+    the columns it needs only
+    :param data: The filtered dataset
+    :type data: pd.DataFrame
+    :param chart: The chart, a key of CHARTS
+    :type chart: str
+    :return: One row per observed group, with the group keys as
+        columns
+    :rtype: pd.DataFrame
+    """
+    keys, values, how = CHARTS[chart]
+    grouped = data[keys + values].groupby(keys, observed=True)
+    if how == 'size':
+        return grouped.size().reset_index(name='Count')
+    return grouped.agg(how).reset_index()
+
+
+def sort_order(data: pd.DataFrame, column: str,
+               ascending: bool = True) -> np.ndarray:
+    """
+    A function that returns the positions of the rows sorted by a
+    column, ties and missing values last kept in row order
+    :param data: The dataset
+    :type data: pd.DataFrame
+    :param column: The column sorted by
+    :type column: str
+    :param ascending: Whether the order is ascending
+    :type ascending: bool
+    :return: The row positions, in order
+    :rtype: np.ndarray
+    """
+    return data[column].reset_index(drop=True).sort_values(
+        ascending=ascending, kind='stable',
+        na_position='last').index.to_numpy()
+
+
+def table_page(data: pd.DataFrame, page: int, page_size: int = PAGE_SIZE,
+               order: Union[np.ndarray, None] = None) -> pd.DataFrame:
+    """
+    A function that returns one page of the data table
+    :param data: The filtered dataset
+    :type data: pd.DataFrame
+    :param page: The page, from 1
+    :type page: int
+    :param page_size: The rows per page
+    :type page_size: int
+    :param order: The row positions in display order, see
+        sort_order, the row order if None
+    :type order: Union[np.ndarray, None]
+    :return: The TABLE_COLUMNS of the rows of the page
+    :rtype: pd.DataFrame
+    """
+    start = (page - 1) * page_size
+    positions = np.arange(start, min(start + page_size, len(data))) \
+        if order is None else order[start:start + page_size]
+    return data.take(positions)[TABLE_COLUMNS]
+
+
+class ChartCache:
+    """
+    Memoizes the chart data, table sort orders and descriptive
+    statistics of the dashboard by country and filter spec,
+    evicting the least recently used, so going back to earlier
+    filters redraws the charts and tables without computing them
+    again.
+
+    use:
+        charts = ChartCache()
+        closure = charts.get('france', spec, 'closure', data)
+    """
+
+    def __init__(self, maxsize: int = 128) -> None:
+        """
+        :param maxsize: The number of chart frames kept
+        :type maxsize: int
+        """
+        self._cache = LRUCache(maxsize)
+
+    def get(self, country: str, spec: FilterSpec, chart: str,
+            data: pd.DataFrame, backend: Any = None) -> pd.DataFrame:
+        """
+        :param country: The country of the dataset
+        :type country: str
+        :param spec: The filters `data` was built with
+        :type spec: FilterSpec
+        :param chart: The chart, a key of CHARTS
+        :type chart: str
+        :param data: The filtered dataset, aggregated on a miss
+        :type data: pd.DataFrame
+        :param backend: Aggregates on a miss instead of `data` when
+            given, e.g. a utils.sql_utils.SqlBackend
+        :type backend: Any
+        :return: The chart data, shared between calls, so not to
+            be modified
+        :rtype: pd.DataFrame
+        """
+        if backend is not None:
+            return self._cache.get((country, spec, chart),
+                                   lambda: backend.aggregate(spec, chart))
+        return self._cache.get((country, spec, chart),
+                               lambda: aggregate(data, chart))
+
+    def table(self, country: str, spec: FilterSpec, page: int,
+              data: pd.DataFrame, backend: Any = None,
+              page_size: int = PAGE_SIZE, sort_by: str = None,
+              ascending: bool = True) -> pd.DataFrame:
+        """
+        :param country: The country of the dataset
+        :type country: str
+        :param spec: The filters `data` was built with
+        :type spec: FilterSpec
+        :param page: The page, from 1
+        :type page: int
+        :param data: The filtered dataset, unused with a backend
+        :type data: pd.DataFrame
+        :param backend: Reads the page instead of `data` when
+            given, e.g. a utils.sql_utils.SqlBackend
+        :type backend: Any
+        :param page_size: The rows per page
+        :type page_size: int
+        :param sort_by: The column sorted by, None for row order
+        :type sort_by: str
+        :param ascending: Whether the order is ascending
+        :type ascending: bool
+        :return: The TABLE_COLUMNS of the rows of the page
+        :rtype: pd.DataFrame
+        """
+        if backend is not None:
+            return self._cache.get(
+                (country, spec, 'page', page, page_size, sort_by, ascending),
+                lambda: backend.select(spec, TABLE_COLUMNS, page_size,
+                                       (page - 1) * page_size, sort_by,
+                                       ascending))
+        order = None if sort_by is None else self._cache.get(
+            (country, spec, 'order', sort_by, ascending),
+            lambda: sort_order(data, sort_by, ascending))
+        return table_page(data, page, page_size, order)
+
+    def describe(self, country: str, spec: FilterSpec, data: pd.DataFrame,
+                 backend: Any = None) -> pd.DataFrame:
+        """
+        :param country: The country of the dataset
+        :type country: str
+        :param spec: The filters `data` was built with
+        :type spec: FilterSpec
+        :param data: The filtered dataset, described on a miss
+        :type data: pd.DataFrame
+        :param backend: Describes instead of `data` when given
+        :type backend: Any
+        :return: The statistics of the numeric columns, as
+            DataFrame.describe computes them
+        :rtype: pd.DataFrame
+        """
+        return self._cache.get(
+            (country, spec, 'describe'), lambda: data.describe()
+            if backend is None else backend.describe(spec))
+
+    def discard(self, stale: Callable[[str], bool]) -> int:
+        """
+        Drop the entries of the stale countries, e.g. those whose
+        dataset was unloaded.
+
+        :param stale: Called with the country of each entry, True
+            to drop it
+        :type stale: Callable[[str], bool]
+        :return: The number of entries dropped
+        :rtype: int
+        """
+        return self._cache.discard(lambda key: stale(key[0]))
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+from typing import Iterable, Set, Union
+from urllib.parse import urlsplit
+
+
+def url_path(url: str) -> str:
+    """
+    A function that returns the key of a detail page URL in the
+    ledger, its path, so the same page is known whichever host
+    (BASE_URL) it was scraped from
+    :param url: The detail page URL, absolute or a path
+    :type url: str
+    :return: The path of the URL
+    :rtype: str
+    """
+    return urlsplit(url).path
+
+
+class CheckpointLedger:
+    """
+    A local SQLite ledger of the listing pages and detail URLs
+    finished by the scrapers, per country.
+
+    Work is grouped in crawls: `start` opens a crawl, or resumes
+    the last unfinished one, and `finished_pages` /
+    `finished_urls` only report work done since that crawl
+    started, so a completed crawl never hides rows from the next
+    one. A crawl that is restarted instead of resumed is dropped.
+    `known_urls` only reports the URLs of finished crawls, whose
+    records reached the output files, for incremental refreshes.
+    Detail pages are keyed by URL path
+    (see url_path), with the host they were scraped from kept
+    alongside, so a crawl resumed against another BASE_URL still
+    skips them.
+
+    use:
+        ledger = CheckpointLedger('checkpoints.sqlite')
+        ledger.start('france', resume=True)
+        ledger.mark_page('france', 3, items=10)
+        ledger.finish('france')
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS crawls (
+            country TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL);
+        CREATE TABLE IF NOT EXISTS pages (
+            country TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            items INTEGER NOT NULL,
+            finished_at REAL NOT NULL,
+            PRIMARY KEY (country, page));
+        CREATE TABLE IF NOT EXISTS urls (
+            country TEXT NOT NULL,
+            url TEXT NOT NULL,
+            finished_at REAL NOT NULL,
+            host TEXT,
+            PRIMARY KEY (country, url));
+    '''
+
+    def __init__(self, path: str = 'checkpoints.sqlite') -> None:
+        """
+        :param path: The SQLite file, created if missing
+        :type path: str
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """
+        Key the URLs of ledgers written before the host column by
+        their path.
+        """
+        if 'host' in {i[1] for i in self._conn.execute(
+                'PRAGMA table_info(urls)')}:
+            return
+        rows = self._conn.execute(
+            'SELECT country, url, finished_at FROM urls').fetchall()
+        self._conn.execute('BEGIN')
+        self._conn.execute('ALTER TABLE urls ADD COLUMN host TEXT')
+        self._conn.execute('DELETE FROM urls')
+        # The latest time is kept for a path scraped from several hosts
+        self._conn.executemany(
+            '''INSERT OR REPLACE INTO urls
+               (country, url, finished_at, host) VALUES (?, ?, ?, ?)''',
+            [(country, url_path(url), at, urlsplit(url).hostname)
+             for country, url, at in sorted(rows, key=lambda i: i[2])])
+        self._conn.execute('COMMIT')
+
+    def _current(self, country: str) -> Union[float, None]:
+        """
+        Start time of the unfinished crawl of a country, if any.
+        """
+        row = self._conn.execute(
+            '''SELECT started_at FROM crawls WHERE country = ?
+               AND finished_at IS NULL
+               ORDER BY started_at DESC LIMIT 1''', (country,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, country: str, resume: bool = False) -> bool:
+        """
+        Open a crawl for a country.
+
+        :param country: The country crawled
+        :type country: str
+        :param resume: Continue the last unfinished crawl instead
+            of starting a new one
+        :type resume: bool
+        :return: True if an unfinished crawl was resumed
+        :rtype: bool
+        """
+        with self._lock:
+            if resume and self._current(country) is not None:
+                return True
+            # Its records were dropped, so its URLs are no longer known
+            self._conn.execute(
+                '''DELETE FROM crawls WHERE country = ?
+                   AND finished_at IS NULL''', (country,))
+            self._conn.execute(
+                'INSERT INTO crawls (country, started_at) VALUES (?, ?)',
+                (country, time.time()))
+            return False
+
+    def finish(self, country: str) -> None:
+        """
+        Close the current crawl of a country, once its records are
+        in the output files.
+
+        :param country: The country crawled
+        :type country: str
+        """
+        with self._lock:
+            self._conn.execute(
+                '''UPDATE crawls SET finished_at = ? WHERE country = ?
+                   AND finished_at IS NULL''', (time.time(), country))
+
+    def in_progress(self, country: str) -> bool:
+        """
+        :param country: The country crawled
+        :type country: str
+        :return: True if a crawl of the country is unfinished
+        :rtype: bool
+        """
+        with self._lock:
+            return self._current(country) is not None
+
+    def mark_page(self, country: str, page: int, items: int = 0) -> None:
+        """
+        Record a listing page whose wines were all scraped.
+
+        :param country: The country crawled
+        :type country: str
+        :param page: The listing page number
+        :type page: int
+        :param items: The number of wines of the page
+        :type items: int
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                (country, page, items, time.time()))
+
+    def mark_urls(self, country: str, urls: Iterable[str]) -> None:
+        """
+        Record scraped detail page URLs, by path.
+
+        :param country: The country crawled
+        :type country: str
+        :param urls: The detail page URLs
+        :type urls: Iterable[str]
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                '''INSERT OR REPLACE INTO urls
+                   (country, url, finished_at, host) VALUES (?, ?, ?, ?)''',
+                [(country, url_path(i), now, urlsplit(i).hostname)
+                 for i in urls if i])
+
+    def finished_pages(self, country: str) -> Set[int]:
+        """
+        :param country: The country crawled
+        :type country: str
+        :return: The pages finished by the current crawl
+        :rtype: Set[int]
+        """
+        with self._lock:
+            since = self._current(country) or time.time()
+            return {i for i, in self._conn.execute(
+                '''SELECT page FROM pages WHERE country = ?
+                   AND finished_at >= ?''', (country, since))}
+
+    def finished_urls(self, country: str) -> Set[str]:
+        """
+        :param country: The country crawled
+        :type country: str
+        :return: The paths of the detail URLs finished by the
+            current crawl
+        :rtype: Set[str]
+        """
+        with self._lock:
+            since = self._current(country) or time.time()
+            return {i for i, in self._conn.execute(
+                '''SELECT url FROM urls WHERE country = ?
+                   AND finished_at >= ?''', (country, since))}
+
+    def known_urls(self, country: str) -> Set[str]:
+        """
+        :param country: The country crawled
+        :type country: str
+        :return: The paths of the detail URLs finished by the
+            finished crawls of the country
+        :rtype: Set[str]
+        """
+        with self._lock:
+            return {i for i, in self._conn.execute(
+                '''SELECT url FROM urls WHERE country = ? AND EXISTS (
+                       SELECT 1 FROM crawls WHERE crawls.country = ?
+                       AND crawls.finished_at IS NOT NULL
+                       AND urls.finished_at BETWEEN crawls.started_at
+                       AND crawls.finished_at)''', (country, country))}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
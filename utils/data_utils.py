@@ -0,0 +1,668 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from envyaml import EnvYAML
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+from utils.utils import LRUCache
+from utils.record_utils import NOT_ALCOHOL
+
+CONF = EnvYAML(os.path.join('utils', 'config.yaml'))
+
+CACHE_DIR: str = '.dataset_cache'
+# Memory the DatasetStore keeps its country partitions within
+STORE_BUDGET: int = int(CONF['STORE_BUDGET_MB']) << 20
+# Bump when the cleaning changes, so every cached dataset is rebuilt
+CACHE_VERSION: int = 5
+
+NOT_NUMERIC: str = r'[^0-9.-]'
+# Stripped from the grape names of the index, apostrophes included
+# since the CSV cleaning drops them (Nero d'Avola is NerodAvola)
+GRAPE_NOISE: str = r'[ 0-9%."\']'
+# MIME type of each format the dashboard exports
+EXPORT_FORMATS: Dict[str, str] = {'csv': 'text/csv',
+                                  'parquet': 'application/octet-stream'}
+# Labels repeated across rows, stored as pandas categoricals
+CATEGORY_COLUMNS: Tuple[str, ...] = ('Country', 'Region', 'Producer',
+                                     'Sweetness', 'Wine Type', 'Colour',
+                                     'Closure', 'Body', 'Oak')
+
+
+def source_path(name_: str) -> str:
+    """
+    A function that returns the scraped file a country is loaded
+    from: the typed Parquet file if present, else the CSV
+    :param name_: The country name
+    :type name_: str
+    :return: The path of the file
+    :rtype: str
+    """
+    parquet_ = f'wine_data_{name_}.parquet'
+    return parquet_ if os.path.exists(parquet_) else f'wine_data_{name_}.csv'
+
+
+def file_digest(path: str, chunk: int = 1 << 20) -> str:
+    """
+    A function that returns the SHA-1 of a file's content
+    :param path: The file
+    :type path: str
+    :param chunk: Bytes read at a time
+    :type chunk: int
+    :return: The hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as in_:
+        for block in iter(lambda: in_.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_key(path: str, known: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    A function that identifies the content of a source file by its
+    mtime, size and hash. The file is only hashed again when its
+    mtime or size differ from the `known` key.
+    :param path: The source file
+    :type path: str
+    :param known: The key the cache was built from, if any
+    :type known: Dict[str, Any]
+    :return: The key of the file
+    :rtype: Dict[str, Any]
+    """
+    stat = os.stat(path)
+    key = {'source': path, 'mtime_ns': stat.st_mtime_ns,
+           'size': stat.st_size, 'version': CACHE_VERSION}
+    known = known or {}
+    same = all(known.get(i) == j for i, j in key.items())
+    key['sha1'] = known['sha1'] if same and 'sha1' in known \
+        else file_digest(path)
+    return key
+
+
+def by_unique(values: pd.Series,
+              clean: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """
+    Applies a vectorized cleaning to the distinct values of a
+    column only, and maps the results back to every row with
+    NumPy take; scraped columns repeat a few values many times.
+
+    Args:
+        values: Series without NaN.
+        clean: Cleaning of a series.
+
+    Returns:
+        The cleaned series, with the index of `values`.
+    """
+    codes, uniques = pd.factorize(values)
+    cleaned = clean(pd.Series(uniques, dtype=values.dtype)).to_numpy()
+    return pd.Series(cleaned[codes], index=values.index, name=values.name)
+
+
+def to_number(values: pd.Series) -> pd.Series:
+    """
+    Vectorized float_safe_cast: drops every character but digits,
+    dots and dashes, and casts to float, NaN when that fails.
+
+    Args:
+        values: Series of scraped values.
+
+    Returns:
+        Float series.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    return pd.to_numeric(values.astype(str).str.replace(
+        NOT_NUMERIC, '', regex=True), errors='coerce').astype(float)
+
+
+def clean_alcohol(alcohol: pd.Series) -> pd.Series:
+    """
+    Alcohol % as floats, 0 when missing or when a Body value was
+    scraped in its place.
+
+    Args:
+        alcohol: Alcohol column of the CSV, e.g. '14.00%'.
+
+    Returns:
+        Float series.
+    """
+    def clean(values: pd.Series) -> pd.Series:
+        body = values.astype(str).str.lower().isin(NOT_ALCOHOL)
+        return to_number(values).mask(body, 0.0)
+    return by_unique(alcohol.fillna(0), clean).astype(float)
+
+
+def clean_vintage(vintage: pd.Series) -> pd.Series:
+    """
+    Vintages as floats, 0 when missing.
+
+    Args:
+        vintage: Vintage column of the CSV.
+
+    Returns:
+        Float series.
+    """
+    vintage = vintage.fillna(0)
+    if pd.api.types.is_numeric_dtype(vintage):
+        return vintage.astype(float)
+    return by_unique(vintage, to_number).astype(float)
+
+
+def split_grapes(grapes: pd.Series) -> pd.Series:
+    """
+    Grapes saved as a list repr, e.g. "['84% Cabernet Sauvignon',
+    '16% Merlot']", back to lists of strings; missing grapes
+    give empty lists. Rows with the same grapes share one list.
+
+    Args:
+        grapes: Grapes column of the CSV.
+
+    Returns:
+        Series of lists.
+    """
+    def split(values: pd.Series) -> pd.Series:
+        lists = values.str[1:-1].str.replace(
+            "'", '', regex=False).str.split(',')
+        empty = lists.str[0] == 'a'
+        lists[empty] = pd.Series([[] for _ in range(int(empty.sum()))],
+                                 index=lists.index[empty], dtype=object)
+        return lists
+    return by_unique(grapes.astype(str), split)
+
+
+def read_wine_data(name_: str) -> pd.DataFrame:
+    """
+    Read the scraped data of a country with typed Alcohol, Vintage
+    and Grapes columns.
+
+    Args:
+        name_: Country name.
+
+    Returns:
+        The data frame, Grapes as lists of '84% Cabernet Sauvignon'
+        like strings.
+    """
+    path = source_path(name_)
+    if path.endswith('.parquet'):
+        # Typed records written by the scrapers: no casting or parsing
+        data = pd.read_parquet(path)
+        labels = data.select_dtypes('category').columns
+        data[labels] = data[labels].astype(object)
+        data['Alcohol'] = data['Alcohol'].fillna(0).astype(float).round(2)
+        data['Vintage'] = data['Vintage'].fillna(0).astype(float)
+        data['Grapes'] = data['Grapes'].apply(lambda x: [
+            i['grape'] if i['percent'] is None or i['percent'] != i['percent']
+            else f"{i['percent']:g}% {i['grape']}" for i in x])
+        return data
+
+    data = pd.read_csv(path, sep=';', index_col=0)
+    # storage_client = storage.Client()    # Uncomment to save/load the csv in/from GCS
+    # bucket = storage_client.bucket('my-bucket-name')
+    # blob = bucket.blob(f'wine_data_{name_}.csv')
+    # blob.download_to_filename(f'/tmp/wine_data_{name_}.csv')
+    # data = pd.read_csv(f'/tmp/wine_data_{name_}.csv',
+    #              sep=';', index_col=0)
+
+    data['Alcohol'] = clean_alcohol(data['Alcohol'])
+    data['Vintage'] = clean_vintage(data['Vintage'])
+    data['Grapes'] = split_grapes(data['Grapes'])
+    return data
+
+
+def encode_categories(data: pd.DataFrame,
+                      columns: Iterable[str] = CATEGORY_COLUMNS) -> None:
+    """
+    A function that converts label columns to categoricals with
+    sorted levels, in place
+    :param data: The data frame
+    :type data: pd.DataFrame
+    :param columns: The columns converted
+    :type columns: Iterable[str]
+    """
+    for column in columns:
+        levels = sorted(data[column].dropna().unique(), key=str)
+        data[column] = pd.Categorical(data[column], categories=levels)
+
+
+def category_levels(data: pd.DataFrame) -> Dict[str, List[Any]]:
+    """
+    A function that returns the levels of the categorical columns,
+    as stored with them, without scanning the rows
+    :param data: The data frame
+    :type data: pd.DataFrame
+    :return: The sorted levels of each categorical column
+    :rtype: Dict[str, List[Any]]
+    """
+    return {i: list(data[i].cat.categories)
+            for i in data.select_dtypes('category').columns}
+
+
+class GrapeIndex:
+    """
+    Inverted index of the grapes of a dataset: the row labels of
+    every grape name, from a categorical table with one line per
+    (row, grape). Grape names are matched exactly, without the
+    shares and spaces, e.g. 'CabernetSauvignon'.
+
+    use:
+        grape_index = GrapeIndex.from_grapes(data['Grapes'])
+        data.loc[data.index.isin(grape_index.rows(['Merlot']))]
+    """
+
+    def __init__(self, table: pd.DataFrame) -> None:
+        """
+        :param table: The 'row' labels and categorical 'grape'
+            names, one line per distinct (row, grape)
+        :type table: pd.DataFrame
+        """
+        self.table = table
+        codes = table['grape'].cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order],
+                                 np.arange(len(self.names) + 1))
+        rows = table['row'].to_numpy()[order]
+        self._rows: Dict[str, np.ndarray] = {
+            j: rows[bounds[i]:bounds[i+1]] for i, j in enumerate(self.names)}
+
+    @classmethod
+    def from_grapes(cls, grapes: pd.Series) -> 'GrapeIndex':
+        """
+        :param grapes: The Grapes column, lists of grapes such as
+            '84% Cabernet Sauvignon'
+        :type grapes: pd.Series
+        :return: The index of the grapes by row label
+        :rtype: GrapeIndex
+        """
+        tokens = grapes.explode().dropna()
+        names = by_unique(tokens.astype(str), lambda i: i.str.replace(
+            GRAPE_NOISE, '', regex=True))
+        table = pd.DataFrame({'row': tokens.index.to_numpy(),
+                              'grape': names.to_numpy()})
+        table = table[table['grape'] != ''].drop_duplicates()
+        table['grape'] = table['grape'].astype('category')
+        return cls(table.reset_index(drop=True))
+
+    @property
+    def names(self) -> List[str]:
+        """
+        :return: The grape names, sorted
+        :rtype: List[str]
+        """
+        return list(self.table['grape'].cat.categories)
+
+    def rows(self, grapes: Iterable[str]) -> np.ndarray:
+        """
+        :param grapes: Grape names
+        :type grapes: Iterable[str]
+        :return: The labels of the rows with any of the grapes
+        :rtype: np.ndarray
+        """
+        found = [self._rows[i] for i in grapes if i in self._rows]
+        return np.unique(np.concatenate(found)) if found else \
+            np.array([], dtype=self.table['row'].dtype)
+
+    def categories(self, index: pd.Index) -> pd.Series:
+        """
+        :param index: The row labels of the dataset
+        :type index: pd.Index
+        :return: The grape names of each row, sorted and joined
+            with ', ', '' for rows without grapes
+        :rtype: pd.Series
+        """
+        table = self.table.sort_values(['row', 'grape'])
+        return table['grape'].astype(str).groupby(table['row']).agg(
+            ', '.join).reindex(index, fill_value='')
+
+
+def clean_wine_data(name_: str) -> Tuple[pd.DataFrame, Set[str], GrapeIndex]:
+    """
+    Load the wine data of a country with typed columns (see
+    read_wine_data), fill the missing labels, index the grapes by
+    exact name, join each row's names into Grape_Categories and
+    encode the label columns as categoricals.
+
+    Args:
+        name_: Country name.
+
+    Returns:
+        Tuple of data frame, set of grape names and the grape
+        index of the data frame.
+    """
+    data = read_wine_data(name_)
+    data['Country'] = data['Country'].fillna(name_)
+
+    for i, j in CONF['FILL'].items():
+        data[i] = data[i].fillna(j)
+
+    grape_index = GrapeIndex.from_grapes(data['Grapes'])
+    data['Grape_Categories'] = grape_index.categories(data.index)
+    encode_categories(data)
+    return data, set(grape_index.names), grape_index
+
+
+def cache_paths(name_: str, cache_dir: str = CACHE_DIR
+                ) -> Tuple[str, str, str]:
+    """
+    The Feather files of a country's cached dataset and grape
+    index, and its JSON key.
+    """
+    return (os.path.join(cache_dir, f'wine_data_{name_}.feather'),
+            os.path.join(cache_dir, f'wine_data_{name_}_grapes.feather'),
+            os.path.join(cache_dir, f'wine_data_{name_}.json'))
+
+
+def _write_feather(data: pd.DataFrame, path: str) -> None:
+    feather.write_feather(pa.Table.from_pandas(data, preserve_index=True),
+                          f'{path}.tmp', compression='uncompressed')
+    os.replace(f'{path}.tmp', path)
+
+
+def build_dataset(name_: str, cache_dir: str = CACHE_DIR,
+                  key: Dict[str, Any] = None
+                  ) -> Tuple[pd.DataFrame, Set[str], GrapeIndex]:
+    """
+    Clean the data of a country and cache it, with its grape
+    index, as uncompressed Feather files, read back without
+    decompressing.
+
+    Args:
+        name_: Country name.
+        cache_dir: Directory of the cached datasets.
+        key: Key of the source file, computed if None.
+
+    Returns:
+        Tuple of data frame, set of unique grape categories and
+        the grape index of the data frame.
+    """
+    data, grape_list, grape_index = clean_wine_data(name_)
+    table_, grapes_, meta_ = cache_paths(name_, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_feather(data, table_)
+    _write_feather(grape_index.table, grapes_)
+    with open(f'{meta_}.tmp', 'w', encoding='utf-8') as out_:
+        json.dump(key or source_key(source_path(name_)), out_)
+    os.replace(f'{meta_}.tmp', meta_)
+    return data, grape_list, grape_index
+
+
+def check_cache(name_: str, cache_dir: str = CACHE_DIR
+                ) -> Tuple[bool, Dict[str, Any]]:
+    """
+    A function that checks the cached dataset of a country against
+    its source file
+    :param name_: The country name
+    :type name_: str
+    :param cache_dir: Directory of the cached datasets
+    :type cache_dir: str
+    :return: Whether the cache is up to date, and the key of the
+        source file
+    :rtype: Tuple[bool, Dict[str, Any]]
+    """
+    table_, grapes_, meta_ = cache_paths(name_, cache_dir)
+    known = None
+    if all(os.path.exists(i) for i in (table_, grapes_, meta_)):
+        with open(meta_, encoding='utf-8') as in_:
+            known = json.load(in_)
+    key = source_key(source_path(name_), known)
+    if known is None or key['sha1'] != known.get('sha1') \
+            or key['version'] != known.get('version'):
+        return False, key
+    if key != known:
+        # Touched but unchanged: store the new mtime to skip the hash
+        with open(meta_, 'w', encoding='utf-8') as out_:
+            json.dump(key, out_)
+    return True, key
+
+
+def dataset_files(name_: str, cache_dir: str = CACHE_DIR
+                  ) -> Tuple[str, str]:
+    """
+    A function that returns the cached Feather files of a country,
+    the dataset and its grape index, building them if they are
+    missing or stale
+    :param name_: The country name
+    :type name_: str
+    :param cache_dir: Directory of the cached datasets
+    :type cache_dir: str
+    :return: The paths of the dataset and grape index files
+    :rtype: Tuple[str, str]
+    """
+    fresh, key = check_cache(name_, cache_dir)
+    if not fresh:
+        build_dataset(name_, cache_dir, key)
+    return cache_paths(name_, cache_dir)[:2]
+
+
+def load_dataset(name_: str, cache_dir: str = CACHE_DIR
+                 ) -> Tuple[pd.DataFrame, Set[str], GrapeIndex]:
+    """
+    Load the cleaned data of a country from its cached dataset,
+    rebuilding it only when the source file changed.
+
+    Args:
+        name_: Country name.
+        cache_dir: Directory of the cached datasets.
+
+    Returns:
+        Tuple of data frame, set of unique grape categories and
+        the grape index of the data frame.
+    """
+    table_, grapes_, _ = cache_paths(name_, cache_dir)
+    fresh, key = check_cache(name_, cache_dir)
+    if not fresh:
+        return build_dataset(name_, cache_dir, key)
+    # The frame is a copy of the file, the grape lists Python objects
+    data = feather.read_table(table_).to_pandas()
+    data['Grapes'] = data['Grapes'].map(list)
+    grape_index = GrapeIndex(feather.read_table(grapes_).to_pandas())
+    return data, set(grape_index.names), grape_index
+
+
+Dataset = Tuple[pd.DataFrame, Set[str], GrapeIndex]
+
+
+class DatasetStore:
+    """
+    The cleaned datasets of the dashboard, partitioned by country.
+    Partitions are loaded from their caches (see load_dataset) when
+    first requested, and the least recently used are dropped once
+    their memory exceeds the budget, together with the combined
+    datasets holding them, and `on_evict` is told which countries
+    were dropped so the caches built on them can follow. Several
+    countries are read as one dataset whose categorical columns
+    are recoded on a single dictionary, the sorted levels of those
+    countries, when they are combined.
+
+    use:
+        store = DatasetStore(budget=256 << 20)
+        data, grape_list, grape_index = store.get(('france', 'italy'))
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR,
+                 budget: int = STORE_BUDGET, views: int = 2,
+                 on_evict: Callable[[List[str]], None] = None) -> None:
+        """
+        :param cache_dir: Directory of the cached datasets
+        :type cache_dir: str
+        :param budget: Bytes of memory kept for the partitions, the
+            partitions of the current request are always kept
+        :type budget: int
+        :param views: The number of multi-country datasets kept
+        :type views: int
+        :param on_evict: Called with the countries dropped, so the
+            objects built on their data can be released too
+        :type on_evict: Callable[[List[str]], None]
+        """
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self._partitions: OrderedDict = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._views = LRUCache(views)
+        self.on_evict = on_evict
+        self._lock = threading.RLock()
+
+    @property
+    def loaded(self) -> List[str]:
+        """
+        :return: The countries loaded, least recently used first
+        :rtype: List[str]
+        """
+        return list(self._partitions)
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    def partition(self, country: str) -> Dataset:
+        """
+        :param country: The country name
+        :type country: str
+        :return: The dataset of a country, loaded if needed
+        :rtype: Dataset
+        """
+        with self._lock:
+            if country not in self._partitions:
+                dataset = load_dataset(country, self.cache_dir)
+                self._partitions[country] = dataset
+                self._sizes[country] = int(
+                    dataset[0].memory_usage(deep=True).sum())
+            self._partitions.move_to_end(country)
+            return self._partitions[country]
+
+    def evict(self, keep: Iterable[str] = ()) -> List[str]:
+        """
+        Drop the least recently used partitions, but `keep`, until
+        the memory of the partitions is within the budget.
+
+        :param keep: The countries kept whatever their memory
+        :type keep: Iterable[str]
+        :return: The countries dropped
+        :rtype: List[str]
+        """
+        keep, dropped = set(keep), []
+        with self._lock:
+            for country in list(self._partitions):
+                if self.size <= self.budget:
+                    break
+                if country not in keep:
+                    del self._partitions[country], self._sizes[country]
+                    dropped.append(country)
+        return dropped
+
+    def get(self, countries: Iterable[str]) -> Dataset:
+        """
+        :param countries: The country names
+        :type countries: Iterable[str]
+        :return: The dataset of the countries, rows renumbered from
+            0 when there are several
+        :rtype: Dataset
+        """
+        countries = tuple(dict.fromkeys(countries))
+        with self._lock:
+            parts = [self.partition(i) for i in countries]
+            dropped = self.evict(countries)
+            if dropped:
+                # Combined views would keep the dropped partitions alive
+                self._views.discard(lambda key: not set(key).isdisjoint(
+                    dropped))
+                if self.on_evict is not None:
+                    self.on_evict(dropped)
+        if len(parts) == 1:
+            return parts[0]
+        return self._views.get(countries, lambda: self._combine(parts))
+
+    def _combine(self, parts: List[Dataset]) -> Dataset:
+        frames = [i[0] for i in parts]
+        labels = list(frames[0].select_dtypes('category').columns)
+        data = pd.concat([i.drop(columns=labels) for i in frames],
+                         ignore_index=True)
+        for column in labels:
+            # Recoded on one dictionary, the sorted levels of the parts
+            data[column] = pd.api.types.union_categoricals(
+                [i[column] for i in frames], sort_categories=True)
+        data = data[frames[0].columns]
+        rows, offset = [], 0
+        for frame, _, grape_index in parts:
+            rows.append(frame.index.get_indexer(
+                grape_index.table['row']) + offset)
+            offset += len(frame)
+        grape_index = GrapeIndex(pd.DataFrame({
+            'row': np.concatenate(rows),
+            'grape': pd.api.types.union_categoricals(
+                [i[2].table['grape'] for i in parts],
+                sort_categories=True)}))
+        return data, set(grape_index.names), grape_index
+
+
+_FILE_BYTES = LRUCache(maxsize=8)
+
+
+def file_bytes(path: str) -> bytes:
+    """
+    A function that returns the content of a file, kept in memory
+    until the file changes
+    :param path: The file
+    :type path: str
+    :return: The bytes of the file
+    :rtype: bytes
+    """
+    stat = os.stat(path)
+
+    def read() -> bytes:
+        with open(path, 'rb') as in_:
+            return in_.read()
+    return _FILE_BYTES.get((path, stat.st_mtime_ns, stat.st_size), read)
+
+
+def export_frame(data: pd.DataFrame, format_: str = 'csv',
+                 sep: str = ';') -> bytes:
+    """
+    A function that serializes a dataset for download
+    :param data: The dataset
+    :type data: pd.DataFrame
+    :param format_: 'csv' or 'parquet', see EXPORT_FORMATS
+    :type format_: str
+    :param sep: The CSV separator
+    :type sep: str
+    :return: The serialized dataset
+    :rtype: bytes
+    """
+    if format_ == 'csv':
+        return data.to_csv(sep=sep).encode('utf-8')
+    if format_ == 'parquet':
+        sink = pa.BufferOutputStream()
+        pq.write_table(pa.Table.from_pandas(data), sink)
+        return sink.getvalue().to_pybytes()
+    raise ValueError(f'Unknown export format {format_!r}')
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the cached datasets of the dashboard')
+    parser.add_argument('countries', nargs='?', default='all',
+                        help='country, comma-separated countries or "all"')
+    parser.add_argument('--cache', default=CACHE_DIR,
+                        help='directory of the cached datasets')
+    args = parser.parse_args()
+    countries = ([i.lower() for i in CONF['COUNTRIES'] if i]
+                 if args.countries == 'all' else args.countries.split(','))
+    for country in countries:
+        data, grape_list, _ = load_dataset(country, args.cache)
+        print(country, len(data), 'rows,', len(grape_list), 'grapes')
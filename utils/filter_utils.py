@@ -0,0 +1,156 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, Iterable, Tuple, Union
+
+from utils.utils import LRUCache
+from utils.data_utils import GrapeIndex
+
+# Columns filtered by the multiselects of the dashboard sidebar
+CHOICE_COLUMNS: Tuple[str, ...] = ('Region', 'Producer', 'Sweetness',
+                                   'Wine Type', 'Colour', 'Closure',
+                                   'Body', 'Oak')
+# Columns filtered by the sliders
+RANGE_COLUMNS: Tuple[str, ...] = ('Alcohol', 'Vintage')
+
+Clause = Tuple[Any, ...]
+
+
+class FilterSpec:
+    """
+    A declarative, hashable set of dashboard filters: the values
+    kept per column, the (low, high) bounds per column, both
+    inclusive, and the grapes of which a row needs at least one.
+    Empty selections filter nothing, and the order of the values
+    does not change the spec, so equal filters hash alike.
+
+    use:
+        spec = FilterSpec(choices={'Region': ['Bordeaux']},
+                          ranges={'Alcohol': (12, 14)},
+                          grapes=['Merlot'])
+    """
+
+    __slots__ = ('choices', 'ranges', 'grapes')
+
+    def __init__(self, choices: Dict[str, Iterable[Any]] = None,
+                 ranges: Dict[str, Tuple[float, float]] = None,
+                 grapes: Iterable[str] = ()) -> None:
+        """
+        :param choices: The values kept for each column
+        :type choices: Dict[str, Iterable[Any]]
+        :param ranges: The inclusive bounds for each column
+        :type ranges: Dict[str, Tuple[float, float]]
+        :param grapes: The grapes of which a row needs one
+        :type grapes: Iterable[str]
+        """
+        self.choices: Tuple[Tuple[str, tuple], ...] = tuple(sorted(
+            (i, tuple(sorted(set(j), key=str)))
+            for i, j in (choices or {}).items() if j))
+        self.ranges: Tuple[Tuple[str, Tuple[float, float]], ...] = tuple(
+            sorted((i, (float(j[0]), float(j[1])))
+                   for i, j in (ranges or {}).items()))
+        self.grapes: Tuple[str, ...] = tuple(sorted(set(grapes)))
+
+    @property
+    def key(self) -> tuple:
+        return self.choices, self.ranges, self.grapes
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, FilterSpec) and self.key == other.key
+
+    def __repr__(self) -> str:
+        return (f'FilterSpec(choices={dict(self.choices)!r}, '
+                f'ranges={dict(self.ranges)!r}, grapes={self.grapes!r})')
+
+    def clauses(self) -> Iterable[Clause]:
+        """
+        :return: One clause per filter, ('isin', column, values),
+            ('between', column, low, high) or ('grapes', grapes)
+        :rtype: Iterable[Clause]
+        """
+        for column, values in self.choices:
+            yield 'isin', column, values
+        for column, (low, high) in self.ranges:
+            yield 'between', column, low, high
+        if self.grapes:
+            yield 'grapes', self.grapes
+
+
+class FilterEngine:
+    """
+    Filters a dataset by FilterSpecs with boolean masks: one mask
+    per clause, isin or between over the column, combined with &
+    and applied with a single take, so no intermediate frames are
+    built. The masks of each clause and the filtered frames of the
+    recent specs are memoized, so changing one filter only
+    computes the mask of that filter.
+
+    use:
+        engine = FilterEngine(data, grape_index)
+        view = engine.apply(spec)
+    """
+
+    def __init__(self, data: pd.DataFrame,
+                 grape_index: Union[GrapeIndex, None] = None,
+                 maxsize: int = 16) -> None:
+        """
+        :param data: The dataset filtered, left unchanged
+        :type data: pd.DataFrame
+        :param grape_index: The grape index of the dataset, needed
+            by specs with grapes
+        :type grape_index: Union[GrapeIndex, None]
+        :param maxsize: The number of filtered frames kept, masks
+            are kept for eight times as many clauses
+        :type maxsize: int
+        """
+        self.data = data
+        self.grape_index = grape_index
+        self._masks = LRUCache(maxsize * 8)
+        self._views = LRUCache(maxsize)
+
+    def _mask(self, clause: Clause) -> np.ndarray:
+        kind, *args = clause
+        if kind == 'isin':
+            mask = self.data[args[0]].isin(args[1])
+        elif kind == 'between':
+            mask = self.data[args[0]].between(args[1], args[2])
+        else:
+            if self.grape_index is None:
+                raise ValueError('Filtering grapes needs a grape index')
+            mask = self.data.index.isin(self.grape_index.rows(args[0]))
+        return np.asarray(mask, dtype=bool)
+
+    def mask(self, spec: FilterSpec) -> np.ndarray:
+        """
+        :param spec: The filters
+        :type spec: FilterSpec
+        :return: The rows kept by every filter of the spec
+        :rtype: np.ndarray
+        """
+        mask = np.ones(len(self.data), dtype=bool)
+        for clause in spec.clauses():
+            mask &= self._masks.get(clause, lambda: self._mask(clause))
+        return mask
+
+    def apply(self, spec: FilterSpec) -> pd.DataFrame:
+        """
+        :param spec: The filters
+        :type spec: FilterSpec
+        :return: The rows of the dataset kept by the spec, shared
+            between calls with equal specs, so not to be modified
+        :rtype: pd.DataFrame
+        """
+        return self._views.get(spec, lambda: self.data.take(
+            np.flatnonzero(self.mask(spec))))
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
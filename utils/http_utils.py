@@ -0,0 +1,105 @@
+import os
+import sys
+import asyncio
+import threading
+
+import aiohttp
+
+from typing import Any, Dict, List, Union
+
+
+class AsyncFetcher:
+    """
+    A pooled HTTP client for threaded code: one aiohttp session,
+    with keep-alive connections, runs on an event loop in a
+    background thread, and any thread can fetch pages through it.
+    At most `concurrency` requests are in flight across threads.
+
+    use:
+        with AsyncFetcher(concurrency=16) as fetcher:
+            pages = fetcher.get_many(urls)
+    """
+
+    HEADERS: Dict[str, str] = {
+        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                      '(KHTML, like Gecko) Chrome/108.0 Safari/537.36'}
+
+    def __init__(self, concurrency: int = 16, timeout: float = 30.0) -> None:
+        """
+        :param concurrency: The maximum number of requests in flight
+        :type concurrency: int
+        :param timeout: The total timeout of a request in seconds
+        :type timeout: float
+        """
+        self.concurrency = concurrency
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+        self._session, self._semaphore = self._run(self._open(timeout))
+
+    def __enter__(self) -> 'AsyncFetcher':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _run(self, coroutine) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _open(self, timeout: float) -> tuple:
+        # The session and semaphore must be created on the loop they run on
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         keepalive_timeout=60)
+        session = aiohttp.ClientSession(
+            connector=connector, headers=self.HEADERS,
+            timeout=aiohttp.ClientTimeout(total=timeout))
+        return session, asyncio.Semaphore(self.concurrency)
+
+    async def _get(self, url: str) -> str:
+        async with self._semaphore:
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                return await response.text()
+
+    async def _get_many(self, urls: List[str]
+                        ) -> List[Union[str, Exception]]:
+        return await asyncio.gather(*(self._get(i) for i in urls),
+                                    return_exceptions=True)
+
+    def get(self, url: str) -> str:
+        """
+        Fetch a page.
+
+        :param url: The page URL
+        :type url: str
+        :return: The page body
+        :rtype: str
+        :raises aiohttp.ClientError: On connection errors and
+            error statuses
+        """
+        return self._run(self._get(url))
+
+    def get_many(self, urls: List[str]) -> List[Union[str, Exception]]:
+        """
+        Fetch pages concurrently.
+
+        :param urls: The page URLs
+        :type urls: List[str]
+        :return: The page bodies in the order of `urls`, or the
+            exception raised for each failed page
+        :rtype: List[Union[str, Exception]]
+        """
+        return self._run(self._get_many(urls))
+
+    def close(self) -> None:
+        self._run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
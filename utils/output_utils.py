@@ -0,0 +1,444 @@
+import os
+import sys
+import csv
+import json
+
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Any, Set
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:    # Parquet output is optional
+    pa = pq = None
+
+# Columns of the wine_data_<country>.csv files read by the dashboard
+WINE_COLUMNS: List[str] = ['Title', 'Producer', 'Brand', 'Vintage',
+                           'Wine Type', 'Colour', 'Country', 'Region',
+                           'Appellation', 'Sweetness', 'Closure',
+                           'Alcohol', 'Body', 'Oak', 'Grapes']
+
+
+class JsonlWriter:
+    """
+    An append-only JSON lines file. Every write is flushed and,
+    unless `sync` is False, synced to disk, so the records written
+    before a crash are never lost.
+
+    Keys starting with an underscore are metadata (e.g. `_page`)
+    and are left out of the assembled CSV.
+
+    use:
+        with JsonlWriter('wine_data_france.jsonl') as sink:
+            sink.write(records)
+    """
+
+    def __init__(self, path: str, mode: str = 'a',
+                 sync: bool = True) -> None:
+        """
+        :param path: The JSON lines file
+        :type path: str
+        :param mode: 'a' to append to an existing stream, 'w' to
+            start a new one
+        :type mode: str
+        :param sync: Sync to disk after every write, not only flush
+            to the OS, for writers called once per record
+        :type sync: bool
+        """
+        self.path = path
+        self.sync = sync
+        self._file = open(path, mode, encoding='utf-8')
+        if self._file.tell():
+            with open(path, 'rb') as file_:
+                file_.seek(-1, os.SEEK_END)
+                if file_.read(1) != b'\n':
+                    # Terminates a line truncated by a crash
+                    self._file.write('\n')
+
+    def __enter__(self) -> 'JsonlWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append records to the stream.
+
+        :param records: The records to append
+        :type records: Iterable[Dict[str, Any]]
+        :return: The number of records written
+        :rtype: int
+        """
+        count = 0
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        return count
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    A function that streams the records of a JSON lines file,
+    skipping a truncated last line left by a crash
+    :param path: The JSON lines file
+    :type path: str
+    :return: An iterator over the records
+    :rtype: Iterator[Dict[str, Any]]
+    """
+    with open(path, 'r', encoding='utf-8') as file_:
+        for line in file_:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _scan_jsonl(path: str, sort_key: str = None
+                ) -> Tuple[List[str], List[int]]:
+    """
+    First pass of jsonl_to_csv: the byte offset of every record,
+    ordered by `sort_key`, and the columns in the order they are
+    first seen in that order.
+    """
+    # Records share few key orders, each is kept once
+    layouts, offsets = {}, []
+    with open(path, 'rb') as file_:
+        offset = file_.tell()
+        for line in iter(file_.readline, b''):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                offset = file_.tell()
+                continue
+            keys = tuple(i for i in record if not i.startswith('_'))
+            offsets.append((record.get(sort_key, 0) if sort_key else 0,
+                            offset, layouts.setdefault(keys, keys)))
+            offset = file_.tell()
+    offsets.sort(key=lambda x: x[0])
+    columns = {}
+    for _, _, keys in offsets:
+        columns.update((i, None) for i in keys)
+    return list(columns), [i for _, i, _ in offsets]
+
+
+def _csv_value(value: Any) -> Any:
+    return '' if value is None else str(value) if isinstance(
+        value, (list, tuple, dict)) else value
+
+
+def jsonl_to_csv(src: str, dst: str, sep: str = ';',
+                 sort_key: str = '_page') -> int:
+    """
+    A function that assembles the CSV read by the dashboard from
+    a JSON lines stream, holding one record at a time in memory.
+    The output matches pandas' DataFrame.from_records(...).to_csv:
+    a leading unnamed index column and list values written as
+    their Python repr
+    :param src: The JSON lines stream
+    :type src: str
+    :param dst: The CSV file to write
+    :type dst: str
+    :param sep: The CSV separator
+    :type sep: str
+    :param sort_key: Metadata key the rows are ordered by, e.g. the
+        page number, since the stream is in completion order
+    :type sort_key: str
+    :return: The number of rows written
+    :rtype: int
+    """
+    columns, offsets = _scan_jsonl(src, sort_key)
+    tmp_ = f'{dst}.tmp'
+    with open(tmp_, 'w', newline='', encoding='utf-8') as out_:
+        writer = csv.writer(out_, delimiter=sep, lineterminator='\n')
+        writer.writerow([''] + columns)
+        for index, record in enumerate(_read_offsets(src, offsets)):
+            writer.writerow([index] + [_csv_value(record.get(i))
+                                       for i in columns])
+    os.replace(tmp_, dst)
+    return len(offsets)
+
+
+def read_csv_column(path: str, column: str, sep: str = ';') -> Set[str]:
+    """
+    A function that reads the distinct values of one column of a
+    CSV written by jsonl_to_csv, one row at a time
+    :param path: The CSV file, missing files give an empty set
+    :type path: str
+    :param column: The column to read
+    :type column: str
+    :param sep: The CSV separator
+    :type sep: str
+    :return: The distinct non-empty values
+    :rtype: Set[str]
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', newline='', encoding='utf-8') as file_:
+        reader = csv.reader(file_, delimiter=sep)
+        header = next(reader, [])
+        if column not in header:
+            return set()
+        index = header.index(column)
+        return {i[index] for i in reader if len(i) > index and i[index]}
+
+
+def _read_offsets(path: str, offsets: List[int]
+                  ) -> Iterator[Dict[str, Any]]:
+    """
+    Second pass over a JSON lines file: the records at `offsets`.
+    """
+    with open(path, 'rb') as in_:
+        for offset in offsets:
+            in_.seek(offset)
+            yield json.loads(in_.readline())
+
+
+def read_csv_rows(path: str, sep: str = ';'
+                   ) -> Tuple[List[str], Iterator[Dict[str, str]]]:
+    """
+    A function that reads a CSV written by jsonl_to_csv lazily
+    :param path: The CSV file
+    :type path: str
+    :param sep: The CSV separator
+    :type sep: str
+    :return: The columns without the index, and an iterator over
+        the rows as dicts
+    :rtype: Tuple[List[str], Iterator[Dict[str, str]]]
+    """
+    file_ = open(path, 'r', newline='', encoding='utf-8')
+    reader = csv.reader(file_, delimiter=sep)
+    columns = next(reader, [''])[1:]
+
+    def rows() -> Iterator[Dict[str, str]]:
+        with file_:
+            for row in reader:
+                yield dict(zip(columns, row[1:]))
+    return columns, rows()
+
+
+def _prepend_rows(columns: List[str], rows: Iterable[Dict[str, Any]],
+                  dst: str, sep: str = ';') -> int:
+    """
+    Rewrites `dst` with `rows` in front of its existing rows,
+    over the union of both column sets, renumbering the index.
+    """
+    old_columns, old_rows = read_csv_rows(dst, sep)
+    columns = list(dict.fromkeys(old_columns + columns))
+    tmp_, count = f'{dst}.tmp', 0
+    with open(tmp_, 'w', newline='', encoding='utf-8') as out_:
+        writer = csv.writer(out_, delimiter=sep, lineterminator='\n')
+        writer.writerow([''] + columns)
+        for record in rows:
+            writer.writerow([count] + [_csv_value(record.get(i))
+                                       for i in columns])
+            count += 1
+        for index, record in enumerate(old_rows, count):
+            writer.writerow([index] + [record.get(i, '') for i in columns])
+    os.replace(tmp_, dst)
+    return count
+
+
+def merge_jsonl_into_csv(src: str, dst: str, sep: str = ';',
+                         sort_key: str = '_page') -> int:
+    """
+    A function that puts the records of a JSON lines stream in
+    front of the rows of an existing CSV, as new reviews come
+    first on the site, and renumbers the index. Columns missing
+    from either side are left empty
+    :param src: The JSON lines stream with the new records
+    :type src: str
+    :param dst: The CSV file to merge into, created if missing
+    :type dst: str
+    :param sep: The CSV separator
+    :type sep: str
+    :param sort_key: Metadata key the new records are ordered by
+    :type sort_key: str
+    :return: The number of new rows
+    :rtype: int
+    """
+    if not os.path.exists(dst):
+        return jsonl_to_csv(src, dst, sep, sort_key)
+    columns, offsets = _scan_jsonl(src, sort_key)
+    return _prepend_rows(columns, _read_offsets(src, offsets), dst, sep)
+
+
+def merge_csv_into_csv(src: str, dst: str, sep: str = ';') -> int:
+    """
+    A function that puts the rows of a CSV in front of the rows
+    of another one, like merge_jsonl_into_csv
+    :param src: The CSV with the new rows
+    :type src: str
+    :param dst: The CSV file to merge into, created if missing
+    :type dst: str
+    :param sep: The CSV separator
+    :type sep: str
+    :return: The number of new rows
+    :rtype: int
+    """
+    columns, rows = read_csv_rows(src, sep)
+    if not os.path.exists(dst):
+        with open(dst, 'w', encoding='utf-8') as file_:
+            file_.write(sep.join([''] + columns) + '\n')
+    return _prepend_rows(columns, rows, dst, sep)
+
+
+class CsvBatchWriter:
+    """
+    Appends records to a CSV in the dashboard's layout (unnamed
+    index column, `;` separated, list values as their repr) over
+    a fixed set of columns, continuing the index of the rows
+    already in the file. Keys outside the columns are ignored.
+
+    use:
+        with CsvBatchWriter('wine_data_france.csv', WINE_COLUMNS) as out_:
+            out_.write(records)
+    """
+
+    def __init__(self, path: str, columns: List[str],
+                 sep: str = ';') -> None:
+        """
+        :param path: The CSV file, appended to if it exists
+        :type path: str
+        :param columns: The columns written, in order
+        :type columns: List[str]
+        :param sep: The CSV separator
+        :type sep: str
+        """
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'r', newline='', encoding='utf-8') as file_:
+                self.rows = sum(1 for _ in csv.reader(
+                    file_, delimiter=sep)) - 1
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file, delimiter=sep,
+                                  lineterminator='\n')
+        if not self.rows and not self._file.tell():
+            self._writer.writerow([''] + columns)
+
+    def __enter__(self) -> 'CsvBatchWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append records to the CSV and flush them.
+
+        :param records: The records to append
+        :type records: Iterable[Dict[str, Any]]
+        :return: The number of records written
+        :rtype: int
+        """
+        start = self.rows
+        for record in records:
+            self._writer.writerow([self.rows] + [
+                _csv_value(record.get(i)) for i in self.columns])
+            self.rows += 1
+        self._file.flush()
+        return self.rows - start
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetBatchWriter:
+    """
+    Writes records to a Parquet file one row group per batch,
+    with every column stored as a string like the CSV unless a
+    typed `schema` and a `convert` function of the records to it
+    are given (see utils.record_utils). Requires pyarrow.
+
+    A Parquet file cannot be appended to and is unreadable until
+    closed, so a resumed writer starts from `seed`, the records
+    already saved elsewhere (e.g. in a CSV written alongside).
+    """
+
+    def __init__(self, path: str, columns: List[str],
+                 seed: Iterable[Dict[str, Any]] = (),
+                 batch_size: int = 1000, schema: 'pa.Schema' = None,
+                 convert: Callable[[Dict[str, Any]], Dict[str, Any]] = None
+                 ) -> None:
+        """
+        :param path: The Parquet file, overwritten
+        :type path: str
+        :param columns: The columns written, in order
+        :type columns: List[str]
+        :param seed: Records written first, in batches
+        :type seed: Iterable[Dict[str, Any]]
+        :param batch_size: Rows per row group of the seed
+        :type batch_size: int
+        :param schema: The schema written, string columns if None
+        :type schema: pa.Schema
+        :param convert: Maps a record to a row of the schema
+        :type convert: Callable[[Dict[str, Any]], Dict[str, Any]]
+        """
+        if pa is None:
+            raise ImportError('pyarrow is required to write Parquet files')
+        self.path = path
+        self.columns = columns
+        self.schema = schema or pa.schema([(i, pa.string()) for i in columns])
+        self.convert = convert or self._strings
+        self._writer = pq.ParquetWriter(path, self.schema)
+        self.write_batches(seed, batch_size)
+
+    def __enter__(self) -> 'ParquetBatchWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Write records as one row group.
+
+        :param records: The records to write
+        :type records: List[Dict[str, Any]]
+        :return: The number of records written
+        :rtype: int
+        """
+        if records:
+            self._writer.write_table(pa.Table.from_pylist(
+                [self.convert(i) for i in records], schema=self.schema))
+        return len(records)
+
+    def _strings(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        return {i: None if record.get(i) in (None, '')
+                else str(_csv_value(record.get(i))) for i in self.columns}
+
+    def write_batches(self, records: Iterable[Dict[str, Any]],
+                      batch_size: int = 1000) -> int:
+        """
+        Write records as row groups of `batch_size` rows.
+
+        :param records: The records to write
+        :type records: Iterable[Dict[str, Any]]
+        :param batch_size: Rows per row group
+        :type batch_size: int
+        :return: The number of records written
+        :rtype: int
+        """
+        batch, count = [], 0
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                count += self.write(batch)
+                batch = []
+        return count + self.write(batch)
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,189 @@
+import os
+import re
+import sys
+
+import lxml.html
+
+from lxml import etree
+from typing import Any, Dict, List, Tuple, Union
+
+"""Extraction of the WineInfo block of Decanter's wine detail pages."""
+
+TITLE_CLASS: str = 'WineInfo_wine-title__X8VR4'
+TYPE_CLASS: str = 'WineInfo_wineInfo__item__type'
+VALUE_CLASS: str = 'WineInfo_wineInfo__item__value'
+
+# One query for the title, the field names and the field values, in
+# document order: text nodes are titles or names, elements are values
+WINE_INFO = etree.XPath(
+    f'//h1[@class="{TITLE_CLASS}"]/text()'
+    f' | //div[contains(@class, "{TYPE_CLASS}")]/text()'
+    f' | //div[contains(@class, "{VALUE_CLASS}")]/div')
+VALUE_DIV = re.compile(r'<div>(.*)</div>')
+VALUE_TOKENS = re.compile(r'(\w*\s?\w+%?)\s*<')
+SPACES = re.compile(r'\s+')
+CLASS_ELEMENT = etree.XPath('(//*[contains(@class, $name)])[1]')
+# Elements rendered on their own lines by a browser
+BLOCK_TAGS: frozenset = frozenset({
+    'address', 'article', 'aside', 'br', 'dd', 'div', 'dl', 'dt',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+    'hr', 'li', 'main', 'nav', 'ol', 'p', 'section', 'table', 'td',
+    'th', 'tr', 'ul'})
+# Inline elements the site's stylesheet ends a line after: the grapes
+# are inline <span>share</span> <a>name</a> pairs shown one per line
+LINE_END_TAGS: frozenset = frozenset({'a'})
+
+
+def grape_parsing(list_: List[str]) -> List[str]:
+    """
+    Function to parse grape information from the data scraped from website.
+
+    Args:
+        list_: list of grape information
+
+    Returns:
+        list: parsed grape information
+    """
+    out = []
+    for i in range(0, len(list_), 2):
+        if list_[i][0].isnumeric():
+            out.append(list_[i].strip() + ' ' + list_[i+1].strip())
+        else:
+            try:
+                out.append(list_[i].strip())
+                out.append(list_[i+1].strip())
+            except:
+                out.append(list_[i].strip())
+    return list(set(out))
+
+
+def parse_value(html: str) -> Union[str, List[str], None]:
+    """
+    Function to parse the HTML of a WineInfo value.
+
+    Args:
+        html: outer HTML of the value's <div>
+
+    Returns:
+        the single text of the value, the parsed grapes when it
+        holds several tokens, or None if the <div> spans lines
+    """
+    match = VALUE_DIV.search(html)
+    if not match:
+        return None
+    inner = match.group(1)
+    tokens = VALUE_TOKENS.findall(inner)
+    if len(tokens) == 1:
+        return tokens[0]
+    if len(tokens) > 1:
+        return grape_parsing(tokens)
+    return inner
+
+
+def parse_wine_detail(root: etree._Element
+                      ) -> Tuple[Union[str, None], Dict[str, Any]]:
+    """
+    Function to extract the WineInfo block of a detail page in a
+    single pass over the document.
+
+    Args:
+        root: lxml root of the page, e.g. `response.selector.root`
+
+    Returns:
+        tuple: the wine title (None if missing) and the wine
+            fields, keyed by the names shown on the page
+    """
+    title, names, values = None, [], []
+    for node in WINE_INFO(root):
+        if not isinstance(node, str):
+            value = parse_value(etree.tostring(
+                node, method='html', encoding='unicode', with_tail=False))
+            if value is not None:
+                values.append(value)
+        elif node.getparent().tag == 'h1':
+            if title is None:
+                title = str(node)
+        else:
+            names.append(str(node))
+    return title, dict(zip(names, values))
+
+
+def inner_text(element: etree._Element,
+               line_end: frozenset = LINE_END_TAGS) -> str:
+    """
+    Function to read the text of an element as a browser renders
+    it, like Selenium's WebElement.text: block elements start new
+    lines, the line_end elements end one, whitespace is collapsed
+    and empty lines are dropped.
+
+    Args:
+        element: lxml element
+        line_end: inline tags rendered with a line break after them
+
+    Returns:
+        str: the rendered text, one line per block
+    """
+    chunks = []
+
+    def walk(node: etree._Element) -> None:
+        block = node.tag in BLOCK_TAGS
+        if block:
+            chunks.append('\n')
+        if node.tag not in ('script', 'style') and node.text:
+            chunks.append(node.text)
+        for child in node:
+            if isinstance(child.tag, str):
+                walk(child)
+            if child.tail:
+                chunks.append(child.tail)
+        if block or node.tag in line_end:
+            chunks.append('\n')
+
+    walk(element)
+    lines = (SPACES.sub(' ', i).strip() for i in ''.join(chunks).split('\n'))
+    return '\n'.join(i for i in lines if i)
+
+
+def class_texts(html: str, *names: str) -> List[Union[str, None]]:
+    """
+    Function to read the rendered text of the first element whose
+    class contains each of the given names, in one parse.
+
+    Args:
+        html: page HTML
+        names: class names, e.g. the title and WineInfo classes
+
+    Returns:
+        list: the text of each element, None if it is missing
+    """
+    root = lxml.html.fromstring(html)
+    texts = []
+    for name in names:
+        found = CLASS_ELEMENT(root, name=name)
+        texts.append(inner_text(found[0]) if found else None)
+    return texts
+
+
+def page_links(html: str, base_url: str, contains: str) -> List[str]:
+    """
+    Function to list the unique absolute links of a page whose
+    href contains a text, in page order.
+
+    Args:
+        html: page HTML
+        base_url: URL of the page, to resolve relative links
+        contains: text the href should contain
+
+    Returns:
+        list: the absolute URLs
+    """
+    root = lxml.html.fromstring(html, base_url=base_url)
+    root.make_links_absolute(base_url)
+    return list(dict.fromkeys(i for i in root.xpath('//a/@href')
+                              if contains in i))
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
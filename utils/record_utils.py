@@ -0,0 +1,168 @@
+import os
+import re
+import sys
+import ast
+
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from utils.utils import float_safe_cast
+from utils.output_utils import (ParquetBatchWriter, WINE_COLUMNS,
+                                read_csv_rows, pa)
+
+GRAPE_SHARE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*%\s*(.+?)\s*$')
+# Body values scraped into the Alcohol field on some pages
+NOT_ALCOHOL: Tuple[str, ...] = ('full', 'medium', 'light')
+
+Grapes = List[Tuple[str, Union[float, None]]]
+
+
+class WineRecord:
+    """
+    A wine review scraped by either scraper, with typed fields:
+    the vintage as an int, the alcohol as a float and the grapes
+    as (grape, percent) pairs, sorted by share then name so both
+    scrapers store them alike.
+
+    use:
+        record = WineRecord.from_scraped({'Title': ..., 'Grapes': [...]})
+        record.alcohol, record.grapes
+    """
+
+    __slots__ = ('title', 'producer', 'brand', 'vintage', 'wine_type',
+                 'colour', 'country', 'region', 'appellation', 'sweetness',
+                 'closure', 'alcohol', 'body', 'oak', 'grapes')
+
+    # Slot of each column of the wine_data_<country> files
+    COLUMNS: Dict[str, str] = dict(zip(WINE_COLUMNS, __slots__))
+
+    def __init__(self, **fields: Any) -> None:
+        """
+        :param fields: The value of each slot, None if missing
+        :type fields: Any
+        """
+        for slot in self.__slots__:
+            setattr(self, slot, fields.get(slot))
+        if self.grapes is None:
+            self.grapes = []
+
+    def __repr__(self) -> str:
+        return f'WineRecord({self.title!r}, vintage={self.vintage!r})'
+
+    @staticmethod
+    def parse_vintage(value: Any) -> Union[int, None]:
+        vintage = float_safe_cast(value) if value not in (None, '') else None
+        return int(vintage) if vintage is not None else None
+
+    @staticmethod
+    def parse_alcohol(value: Any) -> Union[float, None]:
+        if value in (None, '') or str(value).lower() in NOT_ALCOHOL:
+            return None
+        return float_safe_cast(value)
+
+    @staticmethod
+    def parse_grapes(value: Any) -> Grapes:
+        """
+        :param value: The grapes as scraped, a list of strings such
+            as '84% Cabernet Sauvignon', or its repr as saved in
+            the CSV files
+        :type value: Any
+        :return: Unique (grape, percent) pairs, by share then name
+        :rtype: Grapes
+        """
+        if isinstance(value, str):
+            try:
+                value = ast.literal_eval(value) if value.startswith(
+                    '[') else value.split(',')
+            except (ValueError, SyntaxError):
+                value = value.strip('[]').replace("'", '').split(',')
+        pairs = set()
+        for grape in value or []:
+            match = GRAPE_SHARE.match(str(grape))
+            if match:
+                pairs.add((match.group(2), float(match.group(1))))
+            elif str(grape).strip():
+                pairs.add((str(grape).strip(), None))
+        return sorted(pairs, key=lambda i: (-(i[1] or 0), i[0]))
+
+    @classmethod
+    def from_scraped(cls, item: Dict[str, Any]) -> 'WineRecord':
+        """
+        Build a record from a scraped item or a CSV row, keyed by
+        the column names. Unknown and metadata keys are ignored.
+
+        :param item: The scraped item
+        :type item: Dict[str, Any]
+        :return: The typed record
+        :rtype: WineRecord
+        """
+        fields = {j: item.get(i) if item.get(i) != '' else None
+                  for i, j in cls.COLUMNS.items()}
+        fields['vintage'] = cls.parse_vintage(fields['vintage'])
+        fields['alcohol'] = cls.parse_alcohol(fields['alcohol'])
+        fields['grapes'] = cls.parse_grapes(fields['grapes'])
+        return cls(**fields)
+
+    def to_arrow(self) -> Dict[str, Any]:
+        """
+        :return: The record keyed by column, as WINE_SCHEMA expects
+        :rtype: Dict[str, Any]
+        """
+        row = {i: getattr(self, j) for i, j in self.COLUMNS.items()}
+        row['Grapes'] = [{'grape': i, 'percent': j} for i, j in self.grapes]
+        return row
+
+
+# Typed layout of wine_data_<country>.parquet: repeated labels are
+# dictionary encoded, so they load as pandas categoricals
+_LABEL = pa.dictionary(pa.int32(), pa.string()) if pa else None
+WINE_SCHEMA = pa.schema([
+    ('Title', pa.string()), ('Producer', _LABEL), ('Brand', pa.string()),
+    ('Vintage', pa.int32()), ('Wine Type', _LABEL), ('Colour', _LABEL),
+    ('Country', _LABEL), ('Region', _LABEL), ('Appellation', _LABEL),
+    ('Sweetness', _LABEL), ('Closure', _LABEL), ('Alcohol', pa.float32()),
+    ('Body', _LABEL), ('Oak', _LABEL),
+    ('Grapes', pa.list_(pa.struct([('grape', pa.string()),
+                                   ('percent', pa.float32())])))
+    ]) if pa else None
+
+
+def wine_parquet_writer(path: str, seed: Iterable[Dict[str, Any]] = (),
+                        batch_size: int = 1000) -> ParquetBatchWriter:
+    """
+    A function that opens a Parquet writer of scraped items in the
+    typed WINE_SCHEMA layout
+    :param path: The Parquet file, overwritten
+    :type path: str
+    :param seed: Items written first, e.g. the rows of a CSV
+    :type seed: Iterable[Dict[str, Any]]
+    :param batch_size: Rows per row group of the seed
+    :type batch_size: int
+    :return: The writer
+    :rtype: ParquetBatchWriter
+    """
+    return ParquetBatchWriter(
+        path, WINE_COLUMNS, seed, batch_size, schema=WINE_SCHEMA,
+        convert=lambda i: WineRecord.from_scraped(i).to_arrow())
+
+
+def csv_to_wine_parquet(src: str, dst: str, sep: str = ';') -> int:
+    """
+    A function that converts a wine_data_<country>.csv file to its
+    typed Parquet counterpart, in row-group batches
+    :param src: The CSV file
+    :type src: str
+    :param dst: The Parquet file
+    :type dst: str
+    :param sep: The CSV separator
+    :type sep: str
+    :return: The number of rows written
+    :rtype: int
+    """
+    with wine_parquet_writer(dst) as writer:
+        return writer.write_batches(read_csv_rows(src, sep)[1])
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
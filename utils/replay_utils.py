@@ -0,0 +1,228 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Union
+
+DECANTER: str = 'https://www.decanter.com'
+LISTING: str = '/wine-reviews/search/{country}/page/{page}/3'
+CORPUS: str = os.path.join('benchmarks', 'corpus')
+
+
+def corpus_path(url: str, corpus: str = CORPUS) -> str:
+    """
+    A function that maps a page URL to its file in the corpus,
+    mirroring the URL path
+    :param url: The page URL, or its path
+    :type url: str
+    :param corpus: The corpus directory
+    :type corpus: str
+    :return: The path of the saved page
+    :rtype: str
+    """
+    path = urllib.parse.urlsplit(url).path.strip('/') or 'index'
+    return os.path.join(corpus, *path.split('/')) + '.html'
+
+
+def fetch(url: str, timeout: int = 30) -> bytes:
+    """
+    A function that downloads a page with a browser user agent
+    :param url: The page URL
+    :type url: str
+    :param timeout: The timeout in seconds
+    :type timeout: int
+    :return: The page body
+    :rtype: bytes
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    with urllib.request.urlopen(request, timeout=timeout) as in_:
+        return in_.read()
+
+
+def record(country: str, pages: int, corpus: str = CORPUS,
+           base_url: str = DECANTER, delay: float = 1.0) -> int:
+    """
+    A function that saves the listing pages of a country and the
+    detail pages they link to into the corpus, skipping the pages
+    already saved
+    :param country: The country crawled
+    :type country: str
+    :param pages: The number of listing pages saved
+    :type pages: int
+    :param corpus: The corpus directory
+    :type corpus: str
+    :param base_url: The site recorded
+    :type base_url: str
+    :param delay: Seconds waited between downloads
+    :type delay: float
+    :return: The number of pages downloaded
+    :rtype: int
+    """
+    links = re.compile(rf'href="([^"]*/wine-reviews/{country}/[^"]*)"')
+    count = 0
+
+    def save(url: str) -> bytes:
+        nonlocal count
+        path = corpus_path(url, corpus)
+        if os.path.exists(path):
+            with open(path, 'rb') as in_:
+                return in_.read()
+        body = fetch(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out_:
+            out_.write(body)
+        count += 1
+        time.sleep(delay)
+        return body
+
+    for page in range(1, pages+1):
+        body = save(base_url + LISTING.format(country=country, page=page))
+        for link in dict.fromkeys(links.findall(body.decode('utf-8'))):
+            save(urllib.parse.urljoin(base_url, link))
+    return count
+
+
+class ReplayServer:
+    """
+    Serves a recorded corpus over a local HTTP server, with a fixed
+    latency and a rate of 503 errors per request, so the scrapers
+    can be measured without network. Absolute links to the
+    recorded site are rewritten to the server.
+
+    use:
+        with ReplayServer(latency=0.2, error_rate=0.05) as server:
+            main('france', base_url=server.base_url)
+    """
+
+    def __init__(self, corpus: str = CORPUS, latency: float = 0.0,
+                 error_rate: float = 0.0, port: int = 0,
+                 host: str = '127.0.0.1', recorded: str = DECANTER,
+                 seed: Union[int, None] = None) -> None:
+        """
+        :param corpus: The corpus directory
+        :type corpus: str
+        :param latency: Seconds waited before each response
+        :type latency: float
+        :param error_rate: Share of requests answered with a 503
+        :type error_rate: float
+        :param port: The port served, 0 for any free port
+        :type port: int
+        :param host: The interface served
+        :type host: str
+        :param recorded: The site the corpus was recorded from
+        :type recorded: str
+        :param seed: Seed of the error draws, for reproducible runs
+        :type seed: Union[int, None]
+        """
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.recorded = recorded.encode()
+        self.stats: Dict[str, int] = {'served': 0, 'errors': 0, 'missing': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f'http://{host}:{self._server.server_address[1]}'
+        self._thread = None
+
+    def _handler(self) -> type:
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                code, body = replay.respond(self.path)
+                self.send_response(code)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return Handler
+
+    def respond(self, path: str) -> tuple:
+        """
+        The status code and body served for a path.
+        """
+        time.sleep(self.latency)
+        with self._lock:
+            error = self._random.random() < self.error_rate
+        file_ = corpus_path(path, self.corpus)
+        if error:
+            key, code, body = 'errors', 503, b''
+        elif not os.path.exists(file_):
+            key, code, body = 'missing', 404, b''
+        else:
+            with open(file_, 'rb') as in_:
+                key, code, body = 'served', 200, in_.read().replace(
+                    self.recorded, self.base_url.encode())
+        with self._lock:
+            self.stats[key] += 1
+        return code, body
+
+    def start(self) -> 'ReplayServer':
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'ReplayServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Record Decanter pages or replay them locally')
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_ = commands.add_parser('record', help='save pages to the corpus')
+    record_.add_argument('-c', '--country', default='france')
+    record_.add_argument('-p', '--pages', type=int, default=1)
+    record_.add_argument('--delay', type=float, default=1.0,
+                         help='seconds between downloads')
+    serve_ = commands.add_parser('serve', help='serve the corpus')
+    serve_.add_argument('--port', type=int, default=8000)
+    serve_.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='seconds before each response')
+    serve_.add_argument('-e', '--error-rate', type=float, default=0.0,
+                        help='share of requests answered with a 503')
+    serve_.add_argument('--seed', type=int, default=None)
+    for command in (record_, serve_):
+        command.add_argument('--corpus', default=CORPUS)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        print(record(args.country.lower(), args.pages, args.corpus,
+                     delay=args.delay), 'pages saved to', args.corpus)
+    else:
+        server = ReplayServer(args.corpus, args.latency, args.error_rate,
+                              args.port, seed=args.seed).start()
+        print('serving', args.corpus, 'at', server.base_url)
+        try:
+            while True:
+                time.sleep(60)
+                print(server.stats)
+        except KeyboardInterrupt:
+            server.close()
@@ -1,9 +1,15 @@
 import os
 import sys
+import copy
+import time
 import pickle
+import threading
 
 import selenium
 
+from functools import lru_cache
+from contextlib import contextmanager
+
 from selenium import webdriver
 from fake_useragent import UserAgent
 from webdriver_manager.chrome import ChromeDriverManager
@@ -13,28 +19,54 @@ from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
 
-from typing import Union, Dict, List
+from typing import Union, Dict, List, Iterator, FrozenSet
 
 
-def getDriver(*mods: str) -> webdriver.Chrome:
-    """
-    This function creates and returns a Chrome webdriver
-    with specified options.
+_DRIVER_LOCK = threading.Lock()
+_DRIVER_PATH: Union[str, None] = None
 
-    *mods: str
-    userAgent: adds a random user agent to the driver
-    incognito: adds incognito mode to the driver
-    proxy: creates proxy connection through the driver
-    proxy={PROXY:PORT} - overwrites the default proxy, requires proxy
-    maximize: adds maximize mode to the driver
-    headless: run the browser in headless mode
-    
-    :return: webdriver with the *mods specified.
-    :rtype: webdriver.Chrome
+
+def chromedriver_path(path: str = None) -> str:
+    """
+    Resolve the chromedriver binary once per process.
+
+    The first call takes `path`, then the CHROMEDRIVER_PATH
+    environment variable, and only falls back to
+    ChromeDriverManager().install() when neither is set, so
+    offline images with a pre-downloaded driver never reach the
+    manager. Later calls return the cached path.
+
+    :param path: Pre-downloaded chromedriver binary, overrides
+        the cached path when given.
+    :type path: str
+    :return: Path of the chromedriver binary.
+    :rtype: str
+    """
+    global _DRIVER_PATH
+    with _DRIVER_LOCK:
+        if path:
+            _DRIVER_PATH = path
+        elif _DRIVER_PATH is None:
+            _DRIVER_PATH = (os.environ.get('CHROMEDRIVER_PATH')
+                            or ChromeDriverManager().install())
+        return _DRIVER_PATH
+
+
+@lru_cache(maxsize=None)
+def chrome_options(mods: FrozenSet[str]) -> webdriver.ChromeOptions:
+    """
+    Build, once per combination of mods, the ChromeOptions used
+    by getDriver. The random user agent is not part of the
+    cached options since it changes on every driver.
+
+    :param mods: Modifiers of getDriver
+    :type mods: FrozenSet[str]
+    :return: The shared ChromeOptions, not to be modified.
+    :rtype: webdriver.ChromeOptions
     """
     chrome_options = webdriver.ChromeOptions()
-    capabilities = DesiredCapabilities.CHROME
 
     prefs = {"profile.managed_default_content_settings.images": 2}
     chrome_options.add_experimental_option("prefs", prefs)
@@ -44,18 +76,43 @@ def getDriver(*mods: str) -> webdriver.Chrome:
     chrome_options.add_argument('--disable-dev-shm-usage')
     chrome_options.add_argument("--disable-notifications")
 
-    if 'userAgent' in mods:
-        chrome_options.add_argument(
-            f"user-agent={UserAgent().random}")
     if 'incognito' in mods:
         chrome_options.add_argument('--incognito')
     if 'headless' in mods:
         chrome_options.add_argument("--headless")
+    return chrome_options
+
+
+def getDriver(*mods: str, driver_path: str = None) -> webdriver.Chrome:
+    """
+    This function creates and returns a Chrome webdriver
+    with specified options.
+
+    *mods: str
+    userAgent: adds a random user agent to the driver
+    incognito: adds incognito mode to the driver
+    proxy: creates proxy connection through the driver
+    proxy={PROXY:PORT} - overwrites the default proxy, requires proxy
+    maximize: adds maximize mode to the driver
+    headless: run the browser in headless mode
+
+    :param driver_path: Pre-downloaded chromedriver binary, skips
+        ChromeDriverManager. See chromedriver_path.
+    :type driver_path: str
+    :return: webdriver with the *mods specified.
+    :rtype: webdriver.Chrome
+    """
+    options_ = chrome_options(frozenset(
+        i for i in mods if i in ('incognito', 'headless')))
+    if 'userAgent' in mods:
+        options_ = copy.deepcopy(options_)
+        options_.add_argument(
+            f"user-agent={UserAgent().random}")
 
     driver = webdriver.Chrome(
-        ChromeDriverManager().install(),
-        options=chrome_options,
-        desired_capabilities=capabilities)
+        chromedriver_path(driver_path),
+        options=options_,
+        desired_capabilities=DesiredCapabilities.CHROME.copy())
     if 'maximize' in mods:
         driver.maximize_window()
     return driver
@@ -177,6 +234,34 @@ def page_interaction(driver: WebDriver, action: str,
         return False
 
 
+def build_xpath(tag_name: str = '*', *contains: Union[str, List[str]]) -> str:
+    """
+    Build the XPath used by find_element_data.
+
+    :param tag_name: Tag of the element
+    :type tag_name: str
+    :param contains: Values the element's text, class, id, src,
+        style, name, title and alt should contain, in that order
+    :type contains: Union[str, List[str]]
+    :return: The XPath string.
+    :rtype: str
+    """
+    prefix = ['text()', '@class', '@id', '@src', '@style', '@name',
+              '@title', '@alt']
+
+    xpath_fragments = []
+    for i, j in enumerate(contains):
+        if isinstance(j, list):
+            xpath_fragments.append(' and '.join([
+                f"contains({prefix[i]}, '{k}')" for k in j]))
+        elif j:
+            xpath_fragments.append(f"contains({prefix[i]}, '{j}')")
+
+    xpath_ = f"//{tag_name}[{' and '.join(xpath_fragments)}]"
+    [xpath_ := xpath_.replace(f"'{i}'", i) for i in prefix]
+    return xpath_
+
+
 def find_element_data(driver: WebDriver, contains_text: Union[str, List[str]] = '',
                       contains_class: Union[str, List[str]] = '',
                       contains_id: Union[str, List[str]] = '',
@@ -214,21 +299,9 @@ def find_element_data(driver: WebDriver, contains_text: Union[str, List[str]] =
         If `return_xpath` is True and only one element is found,
             the XPath string is returned.
     """
-    tags = [contains_text, contains_class, contains_id, contains_src,
-            contains_style, contains_name, contains_title, contains_alt]
-    prefix = ['text()', '@class', '@id', '@src', '@style', '@name',
-              '@title', '@alt']
-    
-    xpath_fragments = []
-    for i, j in enumerate(tags):
-        if isinstance(j, list):
-            xpath_fragments.append(' and '.join([
-                f"contains({prefix[i]}, '{k}')" for k in j]))
-        elif j:
-            xpath_fragments.append(f"contains({prefix[i]}, '{j}')")
-    
-    xpath_ = f"//{tag_name}[{' and '.join(xpath_fragments)}]"
-    [xpath_ := xpath_.replace(f"'{i}'", i) for i in prefix]
+    xpath_ = build_xpath(tag_name, contains_text, contains_class,
+                         contains_id, contains_src, contains_style,
+                         contains_name, contains_title, contains_alt)
     driver_wait(driver, time, xpath_)
     elements_ = driver.find_elements(By.XPATH, xpath_)
     if return_xpath and len(elements_) == 1:
@@ -244,6 +317,84 @@ def find_element_data(driver: WebDriver, contains_text: Union[str, List[str]] =
     return data_
 
 
+def find_element_data_batched(
+        driver: WebDriver, contains_text: Union[str, List[str]] = '',
+        contains_class: Union[str, List[str]] = '',
+        contains_id: Union[str, List[str]] = '',
+        contains_src: Union[str, List[str]] = '',
+        contains_style: Union[str, List[str]] = '',
+        contains_name: Union[str, List[str]] = '',
+        contains_title: Union[str, List[str]] = '',
+        contains_alt: Union[str, List[str]] = '',
+        return_element: bool = False, tag_name: str = '*',
+        return_xpath: bool = False, time: int = 30) -> Union[
+            Dict[str, Union[str, Dict[str, str]]],
+            List[selenium.webdriver.remote.webelement.WebElement],
+            str, List]:
+    """
+    Same as find_element_data, but the elements, their attributes,
+    tag name and text are all read in a single script call instead
+    of three WebDriver round trips per element.
+
+    Args:
+        driver: An instance of a Selenium WebDriver.
+        contains_?: Optional ? that the element should contain.
+        return_element: Optional flag to indicate whether to return the
+            element(s) found or not. Default is False.
+        return_xpath: Optional flag to indicate whether to return the XPath
+            of the element(s) found or not. Default is False.
+
+    Returns:
+        The same values as find_element_data. The 'text' key holds the
+            rendered innerText of the element.
+    """
+    xpath_ = build_xpath(tag_name, contains_text, contains_class,
+                         contains_id, contains_src, contains_style,
+                         contains_name, contains_title, contains_alt)
+    driver_wait(driver, time, xpath_)
+    elements_, data_ = driver.execute_script(
+        '''var found = document.evaluate(arguments[0], document, null,
+ XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+ var elements = [], data = [];
+ for (var i = 0; i < found.snapshotLength; ++i) {
+  var e = found.snapshotItem(i), items = {};
+  for (var j = 0; j < e.attributes.length; ++j)
+  { items[e.attributes[j].name] = e.attributes[j].value };
+  items['tag_name'] = e.tagName.toLowerCase();
+  items['text'] = e.innerText === undefined ? e.textContent : e.innerText;
+  elements.push(e); data.push(items);
+ }
+ return [elements, data];''', xpath_)
+    if return_xpath and len(elements_) == 1:
+        return xpath_
+    elif not elements_:
+        return f'None found with xpath {xpath_}'
+    return data_ if len(data_) > 1 else data_[0] if not return_element else elements_[0]
+
+
+def get_links(driver: WebDriver, contains_href: str = '',
+              time: int = 5) -> List[str]:
+    """
+    Collect the absolute href of every link on the page whose
+    href contains the given text, in one script call.
+
+    :param driver: The webdriver instance
+    :type driver: WebDriver
+    :param contains_href: Text the href should contain
+    :type contains_href: str
+    :param time: Time to wait for a first matching link
+    :type time: int
+    :return: Unique hrefs in page order.
+    :rtype: List[str]
+    """
+    driver_wait(driver, time, f"//a[contains(@href, '{contains_href}')]",
+                clickable=False)
+    links = driver.execute_script(
+        '''return Array.from(document.querySelectorAll('a[href]'),
+ a => a.href).filter(h => h.includes(arguments[0]));''', contains_href)
+    return list(dict.fromkeys(links or []))
+
+
 def cookie_manager(driver: WebDriver, path: str = 'cookies.pkl',
                    get_: bool = False) -> None:
     """
@@ -267,6 +418,200 @@ def cookie_manager(driver: WebDriver, path: str = 'cookies.pkl',
             driver.add_cookie(cookie)
 
 
+def reset_driver(driver: WebDriver) -> None:
+    """
+    Clear the state left by a previous page so the driver
+    can be reused: extra tabs, cookies and web storage.
+
+    :param driver: The webdriver instance
+    :type driver: WebDriver
+    """
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    try:
+        driver.execute_script(
+            'window.localStorage.clear(); window.sessionStorage.clear();')
+    except WebDriverException:
+        pass
+    driver.delete_all_cookies()
+    driver.get('about:blank')
+
+
+def driver_alive(driver: WebDriver) -> bool:
+    """
+    Check whether the browser behind a webdriver still responds.
+
+    :param driver: The webdriver instance
+    :type driver: WebDriver
+    :return: True if the browser answered a WebDriver command.
+    :rtype: bool
+    """
+    try:
+        driver.window_handles
+        return True
+    except WebDriverException:
+        return False
+
+
+class DriverPool:
+    """
+    A thread-safe pool of long-lived Chrome webdrivers.
+
+    Workers lease a driver for one page and hand it back when done,
+    so Chrome is started at most `size` times per crawl instead of
+    once per page. Drivers are reset between leases and only
+    replaced when the browser stops responding.
+
+    use:
+        with DriverPool(6, 'headless') as pool:
+            with pool.lease(page) as driver:
+                driver.get(url)
+    """
+
+    def __init__(self, size: int, *mods: str,
+                 driver_path: str = None) -> None:
+        """
+        :param size: Maximum number of drivers alive at once,
+            usually the number of executor workers.
+        :type size: int
+        :param mods: Modifiers forwarded to getDriver.
+        :type mods: str
+        :param driver_path: Pre-downloaded chromedriver binary.
+        :type driver_path: str
+        """
+        self.size = size
+        self.mods = mods
+        self.driver_path = driver_path
+        self.stats: List[Dict[str, Union[int, float, bool]]] = []
+        self._idle: List[WebDriver] = []
+        self._drivers: List[WebDriver] = []
+        self._starting = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self) -> 'DriverPool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _acquire(self) -> Union[WebDriver, None]:
+        """
+        Take an idle driver, or reserve a slot for a new one.
+
+        :return: An idle driver, or None if the caller must start one.
+        :rtype: Union[WebDriver, None]
+        """
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if len(self._drivers) + self._starting < self.size:
+                    self._starting += 1
+                    return None
+                self._cond.wait()
+
+    def _start(self) -> WebDriver:
+        """
+        Start a driver in a slot reserved by _acquire.
+        """
+        try:
+            driver = getDriver(*self.mods, driver_path=self.driver_path)
+        except Exception:
+            with self._cond:
+                self._starting -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._starting -= 1
+            self._drivers.append(driver)
+        return driver
+
+    def _release(self, driver: WebDriver) -> None:
+        """
+        Reset a driver and hand it back, or discard it if it crashed.
+        """
+        try:
+            reset_driver(driver)
+        except Exception:
+            if not driver_alive(driver):
+                with self._cond:
+                    if driver in self._drivers:
+                        self._drivers.remove(driver)
+                    self._cond.notify()
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+                return
+        with self._cond:
+            if driver in self._drivers:
+                self._idle.append(driver)
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self, page: int = None) -> Iterator[WebDriver]:
+        """
+        Lease a driver for the duration of a with block.
+
+        Starts a new driver if the pool is not full yet, otherwise
+        waits for one to be released. On exit the driver is reset
+        and returned to the pool, or replaced if it crashed.
+
+        :param page: Page number recorded in the lease stats.
+        :type page: int
+        :return: A ready to use webdriver.
+        :rtype: Iterator[WebDriver]
+        """
+        startup, driver = 0.0, self._acquire()
+        if driver is None:
+            start = time.perf_counter()
+            driver = self._start()
+            startup = time.perf_counter() - start
+        start, failed = time.perf_counter(), False
+        try:
+            yield driver
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.stats.append({
+                'page': page, 'startup': startup,
+                'scrape': time.perf_counter() - start,
+                'failed': failed})
+            self._release(driver)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Aggregate the per-page lease stats.
+
+        :return: Pages served, drivers started and the total
+            seconds spent starting drivers against scraping.
+        :rtype: Dict[str, float]
+        """
+        stats = list(self.stats)
+        return {
+            'pages': len(stats),
+            'drivers_started': sum(1 for i in stats if i['startup']),
+            'startup_seconds': round(sum(i['startup'] for i in stats), 2),
+            'scrape_seconds': round(sum(i['scrape'] for i in stats), 2),
+            'failed_pages': sum(1 for i in stats if i['failed'])}
+
+    def close(self) -> None:
+        """
+        Quit every driver owned by the pool.
+        """
+        with self._cond:
+            drivers, self._drivers, self._idle = self._drivers, [], []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
 file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
 dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
 if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
@@ -0,0 +1,261 @@
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from typing import Any, Dict, Iterable, List, Set, Tuple, Union
+
+from utils.data_utils import dataset_files, CACHE_DIR
+from utils.chart_utils import CHARTS
+from utils.filter_utils import FilterSpec, CHOICE_COLUMNS, RANGE_COLUMNS
+
+try:
+    import duckdb
+except ImportError:    # The SQL backend is optional
+    duckdb = None
+
+# Column pandas stores the row labels of a dataset in
+INDEX_COLUMN: str = '__index_level_0__'
+AGGREGATES: Dict[str, str] = {'mean': 'AVG', 'count': 'COUNT'}
+# Rows of DataFrame.describe for numeric columns
+DESCRIBE: List[str] = ['count', 'mean', 'std', 'min', '25%', '50%', '75%',
+                       'max']
+
+
+def quote(name: str) -> str:
+    """
+    A function that quotes a column name for SQL
+    :param name: The column name
+    :type name: str
+    :return: The quoted name
+    :rtype: str
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def compile_where(spec: FilterSpec) -> Tuple[str, List[Any]]:
+    """
+    A function that compiles a filter spec to the WHERE clause of
+    a query over the `wines` view, with ? placeholders
+    :param spec: The filters
+    :type spec: FilterSpec
+    :return: The condition and its parameters
+    :rtype: Tuple[str, List[Any]]
+    """
+    conditions, params = [], []
+    for kind, *args in spec.clauses():
+        if kind == 'isin':
+            conditions.append(f'{quote(args[0])} IN '
+                              f'({", ".join("?" * len(args[1]))})')
+            params.extend(args[1])
+        elif kind == 'between':
+            conditions.append(f'{quote(args[0])} BETWEEN ? AND ?')
+            params.extend(args[1:])
+        else:
+            conditions.append(
+                'EXISTS (SELECT 1 FROM grapes WHERE grapes._part = '
+                f'wines._part AND grapes.row = wines.{quote(INDEX_COLUMN)} '
+                f'AND grapes.grape IN ({", ".join("?" * len(args[0]))}))')
+            params.extend(args[0])
+    return ' AND '.join(conditions) or 'TRUE', params
+
+
+class SqlBackend:
+    """
+    Runs the dashboard filters and chart aggregations as DuckDB
+    queries over the cached Feather files of the countries (see
+    utils.data_utils.dataset_files), scanned as Arrow datasets, so
+    only the columns and rows a query needs are read and nothing
+    is loaded up front.
+
+    use:
+        backend = SqlBackend(('france', 'italy'))
+        closure = backend.aggregate(spec, 'closure')
+        rows = backend.select(spec, limit=50)
+    """
+
+    def __init__(self, countries: Iterable[str],
+                 cache_dir: str = CACHE_DIR) -> None:
+        """
+        :param countries: The country names
+        :type countries: Iterable[str]
+        :param cache_dir: Directory of the cached datasets
+        :type cache_dir: str
+        """
+        if duckdb is None:
+            raise ImportError('The SQL backend needs duckdb, '
+                              'uncomment it in requirements.txt')
+        self.countries = tuple(countries)
+        self._con = duckdb.connect()
+        # A connection runs one query at a time
+        self._lock = threading.Lock()
+        wines, grapes = [], []
+        for part, country in enumerate(self.countries):
+            table_, grapes_ = dataset_files(country, cache_dir)
+            dataset = ds.dataset(table_, format='feather')
+            if not part:
+                self.columns: List[str] = [i for i in dataset.schema.names
+                                           if i != INDEX_COLUMN]
+                # The countries may order their columns differently
+                names = ', '.join(quote(i) for i in dataset.schema.names)
+            self._con.register(f'wines_{part}', dataset)
+            self._con.register(f'grapes_{part}',
+                               ds.dataset(grapes_, format='feather'))
+            wines.append(f'SELECT {names}, {part} AS _part '
+                         f'FROM wines_{part}')
+            grapes.append(f'SELECT row, grape, {part} AS _part '
+                          f'FROM grapes_{part}')
+        self._con.execute('CREATE VIEW wines AS ' + ' UNION ALL '.join(wines))
+        self._con.execute('CREATE VIEW grapes AS '
+                          + ' UNION ALL '.join(grapes))
+
+    def query(self, sql: str, params: List[Any] = None) -> pd.DataFrame:
+        """
+        :param sql: The query
+        :type sql: str
+        :param params: The values of its ? placeholders
+        :type params: List[Any]
+        :return: The result
+        :rtype: pd.DataFrame
+        """
+        with self._lock:
+            return self._con.execute(sql, params or []).fetch_arrow_table(
+                ).to_pandas()
+
+    def select(self, spec: FilterSpec, columns: List[str] = None,
+               limit: Union[int, None] = None, offset: int = 0,
+               order_by: str = None, ascending: bool = True
+               ) -> pd.DataFrame:
+        """
+        :param spec: The filters
+        :type spec: FilterSpec
+        :param columns: The columns read, all if None
+        :type columns: List[str]
+        :param limit: The maximum number of rows, all if None
+        :type limit: Union[int, None]
+        :param offset: The rows skipped first
+        :type offset: int
+        :param order_by: The column sorted by, missing values last,
+            then country and row label
+        :type order_by: str
+        :param ascending: Whether `order_by` is ascending
+        :type ascending: bool
+        :return: The rows kept by the spec, by country and row
+            label, indexed by row label
+        :rtype: pd.DataFrame
+        """
+        where, params = compile_where(spec)
+        names = ', '.join(quote(i) for i in (columns or self.columns))
+        order = f'_part, {quote(INDEX_COLUMN)}'
+        if order_by is not None:
+            order = (f'{quote(order_by)} {"ASC" if ascending else "DESC"} '
+                     f'NULLS LAST, {order}')
+        sql = (f'SELECT {names}, {quote(INDEX_COLUMN)} FROM wines '
+               f'WHERE {where} ORDER BY {order}')
+        if limit is not None:
+            sql += f' LIMIT {int(limit)} OFFSET {int(offset)}'
+        data = self.query(sql, params).set_index(INDEX_COLUMN)
+        data.index.name = None
+        if 'Grapes' in data:
+            data['Grapes'] = data['Grapes'].map(list)
+        return data
+
+    def count(self, spec: FilterSpec) -> int:
+        """
+        :param spec: The filters
+        :type spec: FilterSpec
+        :return: The number of rows kept by the spec
+        :rtype: int
+        """
+        where, params = compile_where(spec)
+        return int(self.query(f'SELECT COUNT(*) AS n FROM wines '
+                              f'WHERE {where}', params)['n'][0])
+
+    def aggregate(self, spec: FilterSpec, chart: str) -> pd.DataFrame:
+        """
+        :param spec: The filters
+        :type spec: FilterSpec
+        :param chart: The chart, a key of utils.chart_utils.CHARTS
+        :type chart: str
+        :return: The chart data, as utils.chart_utils.aggregate
+            computes it
+        :rtype: pd.DataFrame
+        """
+        keys, values, how = CHARTS[chart]
+        where, params = compile_where(spec)
+        groups = ', '.join(quote(i) for i in keys)
+        if how == 'size':
+            columns = 'COUNT(*) AS "Count"'
+        else:
+            columns = ', '.join(f'{AGGREGATES[how]}({quote(i)}) AS {quote(i)}'
+                                for i in values)
+        return self.query(
+            f'SELECT {groups}, {columns} FROM wines WHERE {where} '
+            f'GROUP BY {groups} ORDER BY {groups}', params)
+
+    def describe(self, spec: FilterSpec,
+                 columns: Iterable[str] = RANGE_COLUMNS) -> pd.DataFrame:
+        """
+        :param spec: The filters
+        :type spec: FilterSpec
+        :param columns: The numeric columns
+        :type columns: Iterable[str]
+        :return: The statistics of the columns over the rows kept
+            by the spec, in dataset order, as DataFrame.describe
+            computes them
+        :rtype: pd.DataFrame
+        """
+        where, params = compile_where(spec)
+        stats = pd.DataFrame(index=DESCRIBE)
+        for column in [i for i in self.columns if i in columns]:
+            name = quote(column)
+            stats[column] = self.query(
+                f'SELECT COUNT({name}), AVG({name}), STDDEV_SAMP({name}), '
+                f'MIN({name}), QUANTILE_CONT({name}, 0.25), '
+                f'QUANTILE_CONT({name}, 0.5), QUANTILE_CONT({name}, 0.75), '
+                f'MAX({name}) FROM wines WHERE {where}',
+                params).iloc[0].to_numpy(dtype=float)
+        return stats
+
+    def levels(self, columns: Iterable[str] = CHOICE_COLUMNS
+               ) -> Dict[str, List[Any]]:
+        """
+        :param columns: The label columns
+        :type columns: Iterable[str]
+        :return: The sorted values of each column
+        :rtype: Dict[str, List[Any]]
+        """
+        return {i: sorted(self.query(
+            f'SELECT DISTINCT {quote(i)} AS v FROM wines '
+            f'WHERE {quote(i)} IS NOT NULL')['v'], key=str) for i in columns}
+
+    def bounds(self, columns: Iterable[str] = RANGE_COLUMNS
+               ) -> Dict[str, Tuple[float, float]]:
+        """
+        :param columns: The numeric columns
+        :type columns: Iterable[str]
+        :return: The (min, max) of each column
+        :rtype: Dict[str, Tuple[float, float]]
+        """
+        row = self.query('SELECT ' + ', '.join(
+            f'MIN({quote(i)}), MAX({quote(i)})' for i in columns)
+            + ' FROM wines').iloc[0].tolist()
+        return {j: (row[2*i], row[2*i+1]) for i, j in enumerate(columns)}
+
+    def grapes(self) -> Set[str]:
+        """
+        :return: The grape names of the countries
+        :rtype: Set[str]
+        """
+        return set(self.query('SELECT DISTINCT grape FROM grapes')['grape'])
+
+    def close(self) -> None:
+        self._con.close()
+
+
+file_name = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+dir_name = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+if __name__ == "__main__" or __name__ == f"{dir_name}.{file_name}":
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
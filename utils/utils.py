@@ -1,11 +1,18 @@
 import os
 import re
 import sys
+import json
 import time
+import heapq
+import random
+import logging
+import threading
 
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
 
-from typing import Callable, Union
+from typing import Callable, Hashable, Union, Any, Dict, Tuple, Iterator, List
 
 # Decorators
 
@@ -44,9 +51,250 @@ def timed_retries(max_retries: int,
         return func_with_retries
     return retry_decorator
 
+# Classes
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    A logging formatter that writes one JSON object per record,
+    with the message as `event` and the fields passed through
+    `extra={'fields': {...}}` as extra keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {'time': self.formatTime(record),
+                'level': record.levelname,
+                'logger': record.name,
+                'event': record.getMessage()}
+        data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class LRUCache:
+    """
+    A thread-safe mapping that keeps the `maxsize` most recently
+    used values and computes the missing ones on demand.
+
+    use:
+        cache = LRUCache(maxsize=32)
+        value = cache.get(key, lambda: compute(key))
+    """
+
+    def __init__(self, maxsize: int = 32) -> None:
+        """
+        :param maxsize: The number of values kept
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._values: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._values
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the value of `key`, computing and storing it on a
+        miss, and evict the least recently used values.
+
+        :param key: The key of the value
+        :type key: Hashable
+        :param compute: Called without arguments on a miss
+        :type compute: Callable[[], Any]
+        :return: The value
+        :rtype: Any
+        """
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                self._values.move_to_end(key)
+                return self._values[key]
+            self.misses += 1
+        # Computed outside the lock, a concurrent miss computes it twice
+        value = compute()
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+        return value
+
+    def discard(self, stale: Callable[[Hashable], bool]) -> int:
+        """
+        Drop the values whose key is stale.
+
+        :param stale: Called with each key, True to drop its value
+        :type stale: Callable[[Hashable], bool]
+        :return: The number of values dropped
+        :rtype: int
+        """
+        with self._lock:
+            keys = [i for i in self._values if stale(i)]
+            for key in keys:
+                del self._values[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class RetryScheduler:
+    """
+    Runs keyed tasks on an executor and retries the failed ones
+    with exponential backoff and jitter.
+
+    A failed task (an exception or a None result) is put on a
+    delay queue instead of sleeping inside the worker, so free
+    workers keep taking fresh tasks while it waits. It is
+    resubmitted once its delay has elapsed.
+
+    use:
+        scheduler = RetryScheduler(executor, func)
+        scheduler.submit(key, *args)
+        for key, result in scheduler.as_completed(): ...
+    """
+
+    def __init__(self, executor: Executor, func: Callable,
+                 max_retries: int = 6, base_delay: float = 30.0,
+                 max_delay: float = 600.0,
+                 logger: logging.Logger = None) -> None:
+        """
+        :param executor: The executor running the tasks
+        :type executor: Executor
+        :param func: The function called for every task
+        :type func: Callable
+        :param max_retries: The maximum number of attempts per task
+        :type max_retries: int
+        :param base_delay: The delay in seconds after the first failure,
+            doubled after every following one
+        :type base_delay: float
+        :param max_delay: The upper bound of the delay in seconds
+        :type max_delay: float
+        :param logger: The logger receiving attempts and failures
+        :type logger: logging.Logger
+        """
+        self.executor = executor
+        self.func = func
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = logger or get_logger(func.__name__)
+        self.failed: Dict[Any, BaseException] = {}
+        self._pending: Dict[Future, Tuple[Any, tuple, dict, int]] = {}
+        self._delayed: List[Tuple[float, int, Any, tuple, dict, int]] = []
+        self._seq = 0
+
+    def _submit(self, key: Any, args: tuple, kwargs: dict,
+                attempt: int) -> None:
+        self.logger.info('attempt', extra={'fields': {
+            'task': self.func.__name__, 'key': key, 'attempt': attempt}})
+        future = self.executor.submit(self.func, *args, **kwargs)
+        self._pending[future] = (key, args, kwargs, attempt)
+
+    def submit(self, key: Any, *args, **kwargs) -> None:
+        """
+        Submit a task identified by `key`.
+
+        :param key: Identifier of the task, yielded with its result
+        :type key: Any
+        """
+        self._submit(key, args, kwargs, 1)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        The delay before retrying a task that failed `attempt` times,
+        drawn between half and all of the exponential delay.
+
+        :param attempt: Number of failed attempts
+        :type attempt: int
+        :return: Delay in seconds
+        :rtype: float
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def _handle(self, future: Future) -> Union[Tuple[Any, Any], None]:
+        key, args, kwargs, attempt = self._pending.pop(future)
+        error = future.exception()
+        result = None if error else future.result()
+        if error is None and result is not None:
+            return key, result
+        fields = {'task': self.func.__name__, 'key': key,
+                  'attempt': attempt, 'error': repr(error)}
+        if attempt < self.max_retries:
+            delay = self.backoff(attempt)
+            self._seq += 1
+            heapq.heappush(self._delayed, (
+                time.monotonic() + delay, self._seq,
+                key, args, kwargs, attempt + 1))
+            self.logger.warning('retry scheduled', extra={
+                'fields': fields | {'delay': round(delay, 2)}})
+        else:
+            self.failed[key] = error
+            self.logger.error('failed', extra={'fields': fields})
+        return None
+
+    def as_completed(self) -> Iterator[Tuple[Any, Any]]:
+        """
+        Yield (key, result) for every task as soon as it succeeds,
+        resubmitting failed tasks once their delay has elapsed.
+        Tasks that exhaust their retries are left in `failed`.
+
+        :return: Iterator of (key, result) pairs
+        :rtype: Iterator[Tuple[Any, Any]]
+        """
+        while self._pending or self._delayed:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, key, args, kwargs, attempt = heapq.heappop(
+                    self._delayed)
+                self._submit(key, args, kwargs, attempt)
+            timeout = (max(0.0, self._delayed[0][0] - now)
+                       if self._delayed else None)
+            if not self._pending:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(list(self._pending), timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                item = self._handle(future)
+                if item is not None:
+                    yield item
+
 # Functions
 
 
+def get_logger(name: str, path: str = None) -> logging.Logger:
+    """
+    A function that returns a logger writing JSON lines to
+    stderr and, if given, to an append-only file
+    :param name: The name of the logger
+    :type name: str
+    :param path: The file to append the records to
+    :type path: str
+    :return: The configured logger
+    :rtype: logging.Logger
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handlers = [logging.StreamHandler()]
+        if path:
+            handlers.append(logging.FileHandler(path, encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(JsonFormatter())
+            logger.addHandler(handler)
+    return logger
+
+
 def int_safe_cast(x: any) -> Union[int, None]:
     """
     A function that safely converts a value to int
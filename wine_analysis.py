@@ -1,7 +1,6 @@
 import streamlit as st
 
 import os
-import re
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -11,9 +10,14 @@ from envyaml import EnvYAML
 
 # from google.cloud import storage    # Uncomment to save/load the csv in/from GCS
 
-from typing import List, Tuple
+from typing import List, Set, Tuple
 
-from utils.utils import float_safe_cast
+from utils.data_utils import (category_levels, file_bytes, export_frame,
+                              DatasetStore, GrapeIndex, EXPORT_FORMATS)
+from utils.filter_utils import FilterEngine, FilterSpec, CHOICE_COLUMNS
+from utils.chart_utils import ChartCache, TABLE_COLUMNS, PAGE_SIZE
+from utils.sql_utils import SqlBackend
+from utils.utils import LRUCache
 
 st.set_page_config(layout="wide", page_title="Wine Analysis",
                    page_icon=":Wine_Glass:")
@@ -21,156 +25,247 @@ st.set_page_config(layout="wide", page_title="Wine Analysis",
 FILE_PREF = '' if 'wine_scraping' in os.getcwd() else '/tmp/'
 GCS = False
 CONF = EnvYAML(os.path.join('utils', 'config.yaml'))
+SQL = CONF['QUERY_BACKEND'] == 'duckdb'
 
 
 @st.experimental_singleton
-def load_data(name_: str) -> Tuple[pd.DataFrame, List[str]]:
+def dataset_store() -> DatasetStore:
     """
-    Load wine data and return a filtered data frame with grape list.
+    The datasets of the countries, loaded on demand from their
+    caches (see utils.data_utils) and dropped least recently used
+    first once over the memory budget, with the caches built on
+    their data (see release_countries).
+
+    Returns:
+        Dataset store of the dashboard.
+    """
+    return DatasetStore(f'{FILE_PREF}.dataset_cache',
+                        on_evict=release_countries)
+
+
+@st.experimental_singleton
+def filter_engines() -> LRUCache:
+    """
+    The filter engines of the recent country selections, shared
+    across reruns so the masks of unchanged filters are reused.
+
+    Returns:
+        Cache of the filter engines.
+    """
+    return LRUCache(maxsize=2)
+
+
+def load_data(countries: Tuple[str, ...]
+              ) -> Tuple[pd.DataFrame, Set[str], GrapeIndex]:
+    """
+    Load wine data and return a filtered data frame with grape list,
+    from the dataset store, one partition per country.
 
     Args:
-        name_: Country name.
+        countries: Country names.
 
     Returns:
-        Tuple of data frame and a list of unique grape categories.
-    """
-    data = pd.read_csv(f'wine_data_{name_}.csv',
-                 sep=';', index_col=0)
-    # storage_client = storage.Client()    # Uncomment to save/load the csv in/from GCS
-    # bucket = storage_client.bucket('my-bucket-name')
-    # blob = bucket.blob(f'wine_data_{name_}.csv')
-    # GCS = True
-    # blob.download_to_filename(f'{FILE_PREF}wine_data_{name_}.csv')
-    # data = pd.read_csv(f'{FILE_PREF}wine_data_{name_}.csv',
-    #              sep=';', index_col=0)
-
-    data['Alcohol'] = data['Alcohol'].fillna(0).apply(
-        lambda x: float_safe_cast(0 if str(x).lower() in
-                                ['full', 'medium', 'light'] else x))
-    data['Alcohol'] = data['Alcohol'].apply(lambda x: float(x))
-    data['Vintage'] = data['Vintage'].fillna(0).apply(
-        lambda x: float_safe_cast(x))
-    data['Country'] = data['Country'].fillna(name_)
-    
-    for i, j in CONF['FILL'].items():
-        data[i] = data[i].fillna(j)
-
-    data['Grapes'] = data['Grapes'].apply(
-        lambda x: str(x)[1:-1].replace("'", '').split(',')
-        if str(x)[1:-1].replace("'", '').split(',')[0] != 'a' else [])
-
-    grape_list = re.sub('[0-9%.]', '', str(', '.join(
-        data['Grapes'].fillna('').apply(
-        lambda x: ', '.join(x).replace(' ', '')
-        if x != ['a'] or x != 'a' else None).values))).replace(
-            ',,', ',').replace(' ', '').replace('"', '')
-    grape_list = set(grape_list.split(','))
-    
-    data['Grape_Categories'] = data['Grapes'].apply(lambda x:
-        ', '.join([i for i in grape_list
-                   if i and i in str(x).replace(
-                       ' ', '').replace('"', '')]))
-    return data, grape_list
+        Tuple of data frame, set of unique grape categories and
+        the grape index of the data frame.
+    """
+    return dataset_store().get(countries)
+
+
+def filter_engine(countries: Tuple[str, ...]) -> FilterEngine:
+    """
+    The filter engine of a selection of countries.
+
+    Args:
+        countries: Country names.
+
+    Returns:
+        Filter engine over the data of the countries.
+    """
+    data, _, grape_index = load_data(countries)
+    return filter_engines().get(
+        countries, lambda: FilterEngine(data, grape_index))
+
+
+@st.experimental_singleton
+def sql_backends() -> LRUCache:
+    """
+    The DuckDB backends of the recent country selections.
+
+    Returns:
+        Cache of the SQL backends.
+    """
+    return LRUCache(maxsize=2)
+
+
+def sql_backend(countries: Tuple[str, ...]) -> SqlBackend:
+    """
+    The SQL backend of a selection of countries, querying their
+    cached datasets without loading them.
+
+    Args:
+        countries: Country names.
+
+    Returns:
+        SQL backend over the data of the countries.
+    """
+    return sql_backends().get(countries, lambda: SqlBackend(
+        countries, f'{FILE_PREF}.dataset_cache'))
+
+
+@st.experimental_singleton
+def chart_cache() -> ChartCache:
+    """
+    The chart data of the recent countries and filters, shared
+    across reruns and sessions.
+
+    Returns:
+        Chart cache of the dashboard.
+    """
+    return ChartCache()
+
+
+@st.experimental_singleton
+def export_cache() -> LRUCache:
+    """
+    The exported bytes of the recent filtered datasets, by
+    country, filter spec and format.
+
+    Returns:
+        Cache of the exports.
+    """
+    return LRUCache(maxsize=8)
+
+
+def release_countries(countries: List[str]) -> None:
+    """
+    Drop the filter engines, chart data and exports of every
+    selection including one of the countries, whose datasets
+    were dropped from the dataset store, so they can be freed.
+
+    Args:
+        countries: Country names.
+    """
+    dropped = set(countries)
+    filter_engines().discard(lambda key: not dropped.isdisjoint(key))
+    # Chart data and exports are keyed by the '_'-joined selection
+    chart_cache().discard(
+        lambda selection: not dropped.isdisjoint(selection.split('_')))
+    export_cache().discard(
+        lambda key: not dropped.isdisjoint(key[0].split('_')))
 
 with st.sidebar:
     st.markdown('### Wine Selector')
-    name_ = st.selectbox('Pick a Country:', options=CONF['COUNTRIES'])
+    if st.checkbox('Compare countries'):
+        names_ = st.multiselect('Pick Countries:',
+                                options=[i for i in CONF['COUNTRIES'] if i])
+    else:
+        names_ = [st.selectbox('Pick a Country:', options=CONF['COUNTRIES'])]
+    countries = tuple(i.lower() for i in names_ if i)
+    name_ = ', '.join(i for i in names_ if i)
     if name_:
-        data, grape_list = load_data(name_.lower())
-        image = Image.open(os.path.join(
-            'img', f'wine_{name_.lower()}.jpg'))
-        st.image(image, caption=f'wine {name_.lower()} alt')
+        if SQL:
+            backend = sql_backend(countries)
+            levels, bounds = backend.levels(), backend.bounds()
+            grape_list = backend.grapes()
+        else:
+            data, grape_list, _ = load_data(countries)
+            levels = category_levels(data)
+            bounds = {i: (min(data[i]), max(data[i]))
+                      for i in ('Alcohol', 'Vintage')}
+        for country in countries:
+            image = Image.open(os.path.join('img', f'wine_{country}.jpg'))
+            st.image(image, caption=f'wine {country} alt')
         st.markdown('Use the filters to explore the data')
         st.header('Filters:')
         
         region_filter = st.multiselect(label='Select the Region',
-                                    options=data['Region'].unique())
+                                    options=levels['Region'])
         producer_filter = st.multiselect(label='Select the Producer',
-                                    options=data['Producer'].unique())
+                                    options=levels['Producer'])
         sweetness_filter = st.multiselect(label='Select the Sweetness',
-                                    options=data['Sweetness'].unique())
+                                    options=levels['Sweetness'])
         wine_type_filter = st.multiselect(label='Select the Wine Type',
-                                    options=data['Wine Type'].unique())
+                                    options=levels['Wine Type'])
         colour_filter = st.multiselect(label='Select the Colour',
-                                    options=data['Colour'].unique())
+                                    options=levels['Colour'])
         closure_filter = st.multiselect(label='Select the Closure',
-                                    options=data['Closure'].unique())
+                                    options=levels['Closure'])
         body_filter = st.multiselect(label='Select the Body',
-                                    options=data['Body'].unique())
+                                    options=levels['Body'])
         oak_filter = st.multiselect(label='Select the Oak',
-                                    options=data['Oak'].unique())
+                                    options=levels['Oak'])
         alcohol_filter_min, alcohol_filter_max = st.slider(
             'Select the Alcohol %',
-            min_value=min(data['Alcohol']),
-            max_value=max(data['Alcohol']),
-            value=(min(data['Alcohol']),
-                   max(data['Alcohol'])),
+            min_value=bounds['Alcohol'][0],
+            max_value=bounds['Alcohol'][1],
+            value=bounds['Alcohol'],
             step=0.01)
         vintage_filter_min, vintage_filter_max = st.slider(
             'Select the Vintage',
-            min_value=min(data['Vintage']),
-            max_value=max(data['Vintage']),
-            value=(min(data['Vintage']),
-                   max(data['Vintage'])),
+            min_value=bounds['Vintage'][0],
+            max_value=bounds['Vintage'][1],
+            value=bounds['Vintage'],
             step=1.0)
         grape_filter = st.multiselect(label='Select the Grapes',
-                                    options=grape_list)
+                                    options=sorted(grape_list))
         st.write('\n-------------')
         st.markdown('General Actions:')
-        download_submit = st.download_button(
-            'Download Raw Data', data=pd.read_csv(
-                f'{FILE_PREF if GCS else ""}wine_data_{name_.lower()}.csv',
-              sep=';', index_col=0).to_csv().encode('utf-8'),
-          file_name=f'wine_data_{name_}.csv')
+        for country in countries:
+            download_submit = st.download_button(
+                f'Download Raw Data ({country.title()})' if len(
+                    countries) > 1 else 'Download Raw Data', data=file_bytes(
+                    f'{FILE_PREF if GCS else ""}wine_data_{country}.csv'),
+                file_name=f'wine_data_{country}.csv',
+                mime=EXPORT_FORMATS['csv'])
+        export_filtered = st.checkbox('Export the filtered data')
         st.write('\n-------------')
 
 # User Interface
 st.markdown('# :wine_glass: Wine Analysis')
 st.markdown(f'##### Raw Data Scraped from [here](https://www.decanter.com\
-/wine-reviews/search/{name_ if name_ else "france"}/page/1/3)')
+/wine-reviews/search/{countries[0] if name_ else "france"}/page/1/3)')
 
 st.markdown('### Wine Graphs:')
 st.markdown('\n')
 st.markdown('\n')
 
 if name_:
-    if region_filter:
-        data = data.loc[data['Region'].apply(
-            lambda x: x in region_filter)]
-    if producer_filter:
-        data = data.loc[data['Producer'].apply(
-            lambda x: x in producer_filter)]
-    if sweetness_filter:
-        data = data.loc[data['Sweetness'].apply(
-            lambda x: x in sweetness_filter)]
-    if wine_type_filter:
-        data = data.loc[data['Wine Type'].apply(
-            lambda x: x in wine_type_filter)]
-    if colour_filter:
-        data = data.loc[data['Colour'].apply(
-            lambda x: x in colour_filter)]
-    if closure_filter:
-        data = data.loc[data['Closure'].apply(
-            lambda x: x in closure_filter)]
-    if body_filter:
-        data = data.loc[data['Body'].apply(
-            lambda x: x in body_filter)]
-    if oak_filter:
-        data = data.loc[data['Oak'].apply(
-            lambda x: x in oak_filter)]
-    data = data.loc[data['Alcohol'].apply(lambda x:
-        x >= alcohol_filter_min and x <= alcohol_filter_max)]
-    data = data.loc[data['Vintage'].apply(lambda x:
-        x >= vintage_filter_min and x <= vintage_filter_max)]
-    if grape_filter:
-        data = data.loc[data['Grape_Categories'].apply(
-            lambda x: any(y in x for y in grape_filter))]
+    spec = FilterSpec(
+        choices=dict(zip(CHOICE_COLUMNS, [
+            region_filter, producer_filter, sweetness_filter,
+            wine_type_filter, colour_filter, closure_filter, body_filter,
+            oak_filter])),
+        ranges={'Alcohol': (alcohol_filter_min, alcohol_filter_max),
+                'Vintage': (vintage_filter_min, vintage_filter_max)},
+        grapes=grape_filter)
+    if SQL:
+        backend, data = sql_backend(countries), None
+        rows = backend.count(spec)
+    else:
+        backend, data = None, filter_engine(countries).apply(spec)
+        rows = len(data)
+    selection = '_'.join(countries)
+    charts = chart_cache()
+
+    if export_filtered:
+        with st.sidebar:
+            format_ = st.radio('Export format', options=list(EXPORT_FORMATS),
+                               horizontal=True)
+            st.download_button(
+                'Download Filtered Data',
+                data=export_cache().get((selection, spec, format_),
+                                        lambda: export_frame(
+                    data if backend is None else backend.select(spec),
+                    format_)),
+                file_name=f'wine_data_{selection}_filtered.{format_}',
+                mime=EXPORT_FORMATS[format_])
+            st.write('\n-------------')
 
     sweetness_col, colour_col = st.columns([3, 3])
 
     with sweetness_col:
-        alcohol_sweetness_data = data.groupby(
-            'Sweetness').mean().reset_index()
+        alcohol_sweetness_data = charts.get(
+            selection, spec, 'alcohol_sweetness', data, backend)
         alcohol_sweetness = px.scatter(alcohol_sweetness_data,
                                        size='Alcohol',
                                        x='Alcohol',
@@ -184,8 +279,8 @@ if name_:
             xaxis=(dict(showgrid=False)))
         st.plotly_chart(alcohol_sweetness)
 
-        closure_data_pie = data[['Title', 'Closure']].groupby(
-            'Closure').count().reset_index()
+        closure_data_pie = charts.get(selection, spec, 'closure', data,
+                                      backend)
         closure_pie = px.pie(closure_data_pie, values='Title',
                              names='Closure',
                              title='<b>Distribution of Wine Closures</b>')
@@ -194,28 +289,23 @@ if name_:
         st.plotly_chart(closure_pie)
 
     with colour_col:
-        colour_region_data = data.reset_index().groupby(['Colour',
-                                                         'Region']).count()
-        colour_region_data = colour_region_data.reset_index()
-        colour_region_data = colour_region_data.reset_index(drop=True)
-        melted = pd.melt(colour_region_data, id_vars=['Colour', 'Region'],
-                         value_name='Count')
+        counts = charts.get(selection, spec, 'colour_region', data,
+                            backend)
         colour_region = go.Figure(data=[
-            go.Bar(name='Red', x=melted[melted['Colour'] == 'Red']['Region'], 
-                y=melted[melted['Colour'] == 'Red']['Count']),
-            go.Bar(name='White', x=melted[melted['Colour'] == 'White']['Region'], 
-                y=melted[melted['Colour'] == 'White']['Count']),
-            go.Bar(name='Orange', x=melted[melted['Colour'] == 'Orange']['Region'], 
-                y=melted[melted['Colour'] == 'Orange']['Count']),
-            go.Bar(name='Rosé', x=melted[melted['Colour'] == 'Rosé']['Region'], 
-                y=melted[melted['Colour'] == 'Rosé']['Count'])])
+            go.Bar(name='Red', x=counts[counts['Colour'] == 'Red']['Region'], 
+                y=counts[counts['Colour'] == 'Red']['Count']),
+            go.Bar(name='White', x=counts[counts['Colour'] == 'White']['Region'], 
+                y=counts[counts['Colour'] == 'White']['Count']),
+            go.Bar(name='Orange', x=counts[counts['Colour'] == 'Orange']['Region'], 
+                y=counts[counts['Colour'] == 'Orange']['Count']),
+            go.Bar(name='Rosé', x=counts[counts['Colour'] == 'Rosé']['Region'], 
+                y=counts[counts['Colour'] == 'Rosé']['Count'])])
         colour_region.update_layout(plot_bgcolor='rgba(0,0,0,0)', barmode='stack',
                                     xaxis=(dict(showgrid=False)),
                                     title='<b>Count of Wine Colour by Region</b>')
         st.plotly_chart(colour_region)
         
-        body_data_pie = data[['Title', 'Body', 'Oak']].groupby(
-            ['Body', 'Oak']).count().reset_index()
+        body_data_pie = charts.get(selection, spec, 'body', data, backend)
         body_pie = px.pie(body_data_pie, values='Title', names='Body',
                             title='<b>Distribution of Wine Body</b>',
                             hover_data=['Oak'])
@@ -223,8 +313,8 @@ if name_:
                                xaxis=(dict(showgrid=False)))
         st.plotly_chart(body_pie)
 
-    oak_alcohol_data = data.groupby(
-        ['Oak', 'Grape_Categories', 'Region']).mean().reset_index()
+    oak_alcohol_data = charts.get(selection, spec, 'oak_alcohol', data,
+                                  backend)
     oak_alcohol = px.scatter(oak_alcohol_data, size='Alcohol',
                             x='Alcohol', y='Oak', orientation='h',
                             title='<b>Wine Alcohol % by Oak</b>',
@@ -238,15 +328,31 @@ if name_:
 
     st.write('-----------------------')
     st.markdown('### Data Tables:')
+    pages = max(1, -(-rows // PAGE_SIZE))
+    sort_col, order_col, page_col = st.columns([2, 1, 1])
+    with sort_col:
+        sort_by = st.selectbox('Sort by', options=['Row'] + TABLE_COLUMNS)
+    with order_col:
+        ascending = st.radio('Order', options=['Ascending', 'Descending'],
+                             horizontal=True) == 'Ascending'
+    with page_col:
+        page = int(st.number_input('Page', min_value=1, max_value=pages,
+                                   value=1, step=1))
     data_table, descr_table = st.columns([4, 1])
     
     with data_table:
         st.markdown('#### Cleaned:')
-        st.dataframe(data)
+        st.dataframe(charts.table(
+            selection, spec, page, data, backend,
+            sort_by=None if sort_by == 'Row' else sort_by,
+            ascending=ascending))
+        st.caption(f'Rows {min(rows, (page - 1) * PAGE_SIZE + 1)}-'
+                   f'{min(rows, page * PAGE_SIZE)} of {rows}, '
+                   f'page {page} of {pages}')
 
     with descr_table:
         st.markdown('#### Descriptors:')
-        st.dataframe(data.describe())
+        st.dataframe(charts.describe(selection, spec, data, backend))
 else:
     st.markdown('### Please select a country in the sidebar\
  (:arrow_left:) to visualize the data')